@@ -18,20 +18,25 @@ import numpy as np
 import scipy.stats as stats
 import scipy.optimize as optim
 import scipy.interpolate as interp
-import matplotlib.pyplot as plt
-import h5py
-from sklearn.decomposition import PCA as skPCA
-import requests
-import bs4
-import urllib2
 import re
 from datetime import datetime, date
 import os
 import glob
-import copy
-
-
-class EA:
+import gzip
+import io
+import zlib
+import time
+import shutil
+import bisect
+import string
+import multiprocessing
+import hashlib
+import functools
+import json
+from multiprocessing.pool import ThreadPool
+
+
+class EA(object):
 
     def __init__():
         return
@@ -40,6 +45,138 @@ class EA:
     def getSamples():
         return
 
+    @classmethod
+    def load(cls, fileName, buoyData=True):
+        '''Rebuilds a model saved by saveData from its fitted parameters,
+        without refitting it.
+
+        Parameters
+        ----------
+            fileName : string
+                Name of the .h5 file written by saveData.
+            buoyData : boolean (optional)
+                If True the Hs and T saved with the model are loaded into
+                model.buoy, which bootStrap and plotData use. If False only
+                the parameters, contours and samples are loaded.
+
+        Returns
+        -------
+            model : EA
+                Model of the class saved in the file, ready to compute
+                contours (and samples for PCA).
+
+        Example
+        -------
+        >>> import WDRT.ESSC as ESSC
+        >>> pca46022 = ESSC.PCA.load('NDBC46022.h5', buoyData=False)
+        >>> Hs_Return, T_Return = pca46022.getContours(1., 100., 1000)
+        '''
+        _, file_extension = os.path.splitext(fileName)
+        if not file_extension:
+            fileName = fileName + '.h5'
+        import h5py
+        try:
+            f = h5py.File(fileName, 'r')
+        except IOError:
+            raise IOError("Could not find file: " + fileName)
+        with f:
+            method = f['method'][()]
+            modelCls = _EA_METHODS.get(method)
+            if modelCls is None:
+                raise ValueError("Unknown method %r in %s" % (method, fileName))
+            if not issubclass(modelCls, cls):
+                raise ValueError("%s holds a %s model, not %s" %
+                                 (fileName, modelCls.__name__, cls.__name__))
+            model = modelCls.__new__(modelCls)
+            model.method = method
+            model.Hs_ReturnContours = None
+            model.T_ReturnContours = None
+            model._loadParams(f['parameters'])
+
+            if buoyData and 'buoy_Data' in f:
+                gbd = f['buoy_Data']
+                dateNum = gbd['dateNum'][:] if 'dateNum' in gbd else None
+                model.buoy = _BuoyView(gbd['Hs'][:], gbd['Te'][:],
+                                       dateNum=dateNum)
+            else:
+                model.buoy = _BuoyView(None, None)
+
+            if 'ReturnContours' in f:
+                grc = f['ReturnContours']
+                model.Hs_ReturnContours = grc['Hs_Return'][:]
+                model.T_ReturnContours = grc['T_Return'][:]
+                for name in ('time_ss', 'time_r', 'nb_steps'):
+                    if name in grc.attrs:
+                        setattr(model, name, grc.attrs[name])
+            if 'Samples_FullSeaState' in f:
+                gfss = f['Samples_FullSeaState']
+                model.Hs_SampleFSS = gfss['Hs_SampleFSS'][:]
+                model.T_SampleFSS = gfss['T_SampleFSS'][:]
+                model.Weight_SampleFSS = gfss['Weight_SampleFSS'][:]
+            if 'Samples_ContourApproach' in f:
+                gca = f['Samples_ContourApproach']
+                model.Hs_SampleCA = gca['Hs_SampleCA'][:]
+                model.T_SampleCA = gca['T_SampleCA'][:]
+        return model
+
+    def _loadParams(self, groupObj):
+        '''Sets the fitted parameters written by _saveParams.'''
+        raise NotImplementedError
+
+    def _loadTau(self, groupObj):
+        '''Kendall's tau of T and Hs saved by _saveParams of a copula model.
+        Models saved by earlier versions do not have it, it is then computed
+        from the buoy data saved with them.
+        '''
+        if 'tau' in groupObj:
+            return groupObj['tau'][()]
+        fileObj = groupObj.file
+        if ('buoy_Data' not in fileObj or 'Hs' not in fileObj['buoy_Data'] or
+                'Te' not in fileObj['buoy_Data']):
+            raise ValueError("%s has neither Kendall's tau nor the buoy data "
+                             "to compute it from" % fileObj.filename)
+        gbd = fileObj['buoy_Data']
+        return stats.kendalltau(gbd['Te'][:], gbd['Hs'][:])[0]
+
+    def _iformCircle(self, time_ss, time_r, nb_steps):
+        '''Points of the circles in the standard normal space used by the
+        inverse FORM, for one or several return periods.
+
+        Parameters
+        ----------
+            time_ss : float
+                Sea state duration (hours) of measurements in input.
+            time_r : np.array
+                Return period(s) (years), a scalar or a vector.
+            nb_steps : float
+                Discretization of each circle.
+
+        Returns
+        -------
+            U1 : np.array
+                First coordinate of the points, the circles of all return
+                periods one after another.
+            U2 : np.array
+                Second coordinate of the points.
+            shape : tuple
+                Shape of the contours: (nb_steps,) for a single return
+                period, (len(time_r), nb_steps) otherwise.
+        '''
+        time_r = np.asarray(time_r)
+        # Failure probability for the desired return period (time_R) given the
+        # duration of the measurements (time_ss)
+        p_f = 1 / (365 * (24 / time_ss) * time_r.ravel())
+        beta = stats.norm.ppf((1 - p_f), loc=0, scale=1)  # Reliability
+        theta = np.linspace(0, 2 * np.pi, num = nb_steps)
+        # Vary U1, U2 along circles sqrt(U1^2+U2^2)=beta
+        U1 = np.outer(beta, np.cos(theta)).ravel()
+        U2 = np.outer(beta, np.sin(theta)).ravel()
+        if time_r.size == 1:
+            shape = (len(theta),)
+        else:
+            shape = (time_r.size, len(theta))
+        return U1, U2, shape
+
     def saveData(self, fileName=None):
         """
         Saves all available data obtained via the EA module to
@@ -57,6 +194,7 @@ class EA:
             _, file_extension = os.path.splitext(fileName)
             if not file_extension:
                 fileName = fileName + '.h5'
+        import h5py
         with h5py.File(fileName, 'w') as f:
 
             f.create_dataset('method', data=self.method)
@@ -68,6 +206,10 @@ class EA:
 
             if(self.Hs_ReturnContours is not None):
                 grc = f.create_group('ReturnContours')
+                # Arguments of getContours, used by bootStrap
+                grc.attrs['time_ss'] = self.time_ss
+                grc.attrs['time_r'] = self.time_r
+                grc.attrs['nb_steps'] = self.nb_steps
                 f_T_Return = grc.create_dataset('T_Return', data=self.T_ReturnContours)
                 f_T_Return.attrs['units'] = 's'
                 f_T_Return.attrs['description'] = 'contour, energy period'
@@ -102,9 +244,10 @@ class EA:
         Display a plot of the 100-year return contour, full sea state samples
         and contour samples
         """
+        import matplotlib.pyplot as plt
         plt.figure()
         plt.plot(self.buoy.T, self.buoy.Hs, 'bo', alpha=0.1, label='NDBC data')
-        plt.plot(self.T_ReturnContours, self.Hs_ReturnContours, 'k-', label='100 year contour')
+        self._plotContours(plt, self.T_ReturnContours, self.Hs_ReturnContours, 'k-')
         # plt.plot(self.T_SampleFSS, self.Hs_SampleFSS, 'ro', label='full sea state samples')
         # plt.plot(self.T_SampleCA, self.Hs_SampleCA, 'y^', label='contour approach samples')
         plt.legend(loc='lower right', fontsize='small')
@@ -112,32 +255,67 @@ class EA:
         plt.xlabel('Energy period, $T_e$ [s]')
         plt.ylabel('Sig. wave height, $H_s$ [m]')
         plt.show()
-    
 
-    def getContourPoints(self, T_Sample):
+    def _plotContours(self, plt, T_Return, Hs_Return, style, label=None):
+        '''Plots contours with one line per return period.
+
+        Parameters
+        ----------
+            plt : module
+                matplotlib.pyplot
+            T_Return, Hs_Return : np.array
+                Contours, with the shape returned by getContours.
+            style : string
+                Line style.
+            label : string (optional)
+                Legend entry of the lines. If left blank each line is
+                labelled with its return period.
+        '''
+        T_Return = np.atleast_2d(T_Return)
+        Hs_Return = np.atleast_2d(Hs_Return)
+        time_r = np.atleast_1d(self.time_r)
+        for ii in range(len(T_Return)):
+            if label is None:
+                lineLabel = '%g year contour' % time_r[ii]
+            elif ii == 0:
+                lineLabel = label
+            else:
+                lineLabel = None
+            plt.plot(T_Return[ii], Hs_Return[ii], style, label=lineLabel)
+
+    def getContourPoints(self, T_Sample, period=-1):
         '''Get points along a specified environmental contour.
 
         Parameters
         ----------
             T_Sample : nparray
                 points for sampling along return contour
+            period : int (optional)
+                Index in time_r of the return period whose contour is
+                sampled, when getContours computed several. If left blank
+                the contour of the last return period is used.
 
         Returns
         -------
             Hs_SampleCA : nparray
                 points sampled along return contour
         '''
-        amin = np.argmin(self.T_ReturnContours)
-        amax = np.argmax(self.T_ReturnContours)
-
-        w1 = self.Hs_ReturnContours[amin:amax]
-        w2 = np.concatenate((self.Hs_ReturnContours[amax:], self.Hs_ReturnContours[:amin]))
+        T_Return = self.T_ReturnContours
+        Hs_Return = self.Hs_ReturnContours
+        if np.ndim(T_Return) == 2:
+            T_Return = T_Return[period]
+            Hs_Return = Hs_Return[period]
+        amin = np.argmin(T_Return)
+        amax = np.argmax(T_Return)
+
+        w1 = Hs_Return[amin:amax]
+        w2 = np.concatenate((Hs_Return[amax:], Hs_Return[:amin]))
         if (np.max(w1) > np.max(w2)):
-            x1 = self.T_ReturnContours[amin:amax]
-            y = self.Hs_ReturnContours[amin:amax]
+            x1 = T_Return[amin:amax]
+            y1 = Hs_Return[amin:amax]
         else:
-            x1 = np.concatenate((self.T_ReturnContours[amax:], self.T_ReturnContours[:amin]))
-            y1 = np.concatenate((self.Hs_ReturnContours[amax:], self.Hs_ReturnContours[:amin]))
+            x1 = np.concatenate((T_Return[amax:], T_Return[:amin]))
+            y1 = np.concatenate((Hs_Return[amax:], Hs_Return[:amin]))
 
         ms = np.argsort(x1)
         x = x1[ms]
@@ -233,7 +411,8 @@ class EA:
         SteepH = lambdaT * SteepMax
         return SteepH
 
-    def bootStrap(self, boot_size=1000, plotResults=True):
+    def bootStrap(self, boot_size=1000, plotResults=True, workers=1,
+                  random_seed=None):
         '''Get 95% confidence bounds about a contour using the bootstrap
         method.
 
@@ -246,55 +425,84 @@ class EA:
             plotResults: boolean (optional)
                 Option for showing plot of bootstrap confidence bounds. If left
                 blank will be set to True and plot will be shown.
+            workers: int (optional)
+                Number of processes computing bootstrap samples in parallel.
+                If left blank the samples are computed serially.
+            random_seed: int (optional)
+                Seed of the bootstrap samples. Each sample is drawn from its
+                own random stream seeded from it, so the results do not
+                depend on workers. If left blank the seeds are drawn from the
+                global numpy random state.
 
         Returns
         -------
             contourmean_Hs : nparray
                 Hs values for mean contour calculated as the average over all
-                bootstrap contours.
+                bootstrap contours, with the shape of the contours returned
+                by getContours.
             contourmean_T : nparray
                 T values for mean contour calculated as the average over all
                 bootstrap contours.
         '''
-        n = len(self.buoy.Hs)
-        Hs_Return_Boot = np.zeros([self.nb_steps,boot_size])
-        T_Return_Boot = np.zeros([self.nb_steps,boot_size])
-        buoycopy = copy.deepcopy(self.buoy);
-
-        for i in range(boot_size):
-            boot_inds = np.random.randint(0, high=n, size=n)
-            buoycopy.Hs = copy.deepcopy(self.buoy.Hs[boot_inds])
-            buoycopy.T = copy.deepcopy(self.buoy.T[boot_inds])
-            if self.method == "Principle component analysis":
-                essccopy = PCA(buoycopy, self.size_bin)
-            elif self.method == "Gaussian Copula":
-                essccopy = GaussianCopula(buoycopy, self.n_size, self.bin_1_limit, self.bin_step)
-            elif self.method == "Rosenblatt":
-                essccopy = Rosenblatt(buoycopy, self.n_size, self.bin_1_limit, self.bin_step)
-            elif self.method == "Clayton Copula":
-                essccopy = ClaytonCopula(buoycopy, self.n_size, self.bin_1_limit, self.bin_step)
-            elif self.method == "Gumbel Copula":
-                essccopy = GumbelCopula(buoycopy, self.n_size, self.bin_1_limit, self.bin_step, self.Ndata)
-            Hs_Return_Boot[:,i],T_Return_Boot[:,i] = essccopy.getContours(self.time_ss, self.time_r, self.nb_steps)
-
-        contour97_5_Hs = np.percentile(Hs_Return_Boot,97.5,axis=1)
-        contour2_5_Hs = np.percentile(Hs_Return_Boot,2.5,axis=1)
-        contourmean_Hs = np.mean(Hs_Return_Boot, axis=1)
-
-        contour97_5_T = np.percentile(T_Return_Boot,97.5,axis=1)
-        contour2_5_T = np.percentile(T_Return_Boot,2.5,axis=1)
-        contourmean_T = np.mean(T_Return_Boot, axis=1)
+        if self.method == "Principle component analysis":
+            model = (PCA, (self.size_bin,), {})
+        elif self.method == "Gaussian Copula":
+            model = (GaussianCopula, (self.n_size, self.bin_1_limit, self.bin_step), {})
+        elif self.method == "Rosenblatt":
+            model = (Rosenblatt, (self.n_size, self.bin_1_limit, self.bin_step), {})
+        elif self.method == "Clayton Copula":
+            model = (ClaytonCopula, (self.n_size, self.bin_1_limit, self.bin_step), {})
+        elif self.method == "Gumbel Copula":
+            model = (GumbelCopula, (self.n_size, self.bin_1_limit, self.bin_step, self.Ndata),
+                     {'engine': self.engine})
+        # Only Hs and T are resampled, the rest of the buoy is not copied
+        spec = (np.asarray(self.buoy.Hs), np.asarray(self.buoy.T), model,
+                (self.time_ss, self.time_r, self.nb_steps))
+
+        # The seed of every sample is drawn up front, so a sample does not
+        # depend on the process computing it
+        if random_seed is None:
+            rng = np.random
+        else:
+            rng = np.random.RandomState(random_seed)
+        seeds = rng.randint(0, high=2**31 - 1, size=boot_size)
+
+        if workers > 1 and boot_size > 1:
+            pool = multiprocessing.Pool(min(workers, boot_size),
+                                        _initBootStrap, (spec,))
+            try:
+                # map returns the results in the order of seeds
+                results = pool.map(_bootStrapWorker, seeds)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_bootStrapSample(spec, seed) for seed in seeds]
+
+        # One row per bootstrap sample, each holding the contours of every
+        # return period
+        Hs_Return_Boot = np.array([result[0] for result in results])
+        T_Return_Boot = np.array([result[1] for result in results])
+
+        contour97_5_Hs = np.percentile(Hs_Return_Boot,97.5,axis=0)
+        contour2_5_Hs = np.percentile(Hs_Return_Boot,2.5,axis=0)
+        contourmean_Hs = np.mean(Hs_Return_Boot, axis=0)
+
+        contour97_5_T = np.percentile(T_Return_Boot,97.5,axis=0)
+        contour2_5_T = np.percentile(T_Return_Boot,2.5,axis=0)
+        contourmean_T = np.mean(T_Return_Boot, axis=0)
 
         self.contourMean_Hs = contourmean_Hs
         self.contourMean_T = contourmean_T
 
         def plotResults():
+            import matplotlib.pyplot as plt
             plt.figure()
             plt.plot(self.buoy.T, self.buoy.Hs, 'bo', alpha=0.1, label='NDBC data')
-            plt.plot(self.T_ReturnContours, self.Hs_ReturnContours, 'k-', label='100 year contour')
-            plt.plot(contour97_5_T, contour97_5_Hs, 'r--', label='95% bootstrap confidence interval')
-            plt.plot(contour2_5_T, contour2_5_Hs, 'r--')
-            plt.plot(contourmean_T, contourmean_Hs, 'r-', label='Mean bootstrap contour')
+            self._plotContours(plt, self.T_ReturnContours, self.Hs_ReturnContours, 'k-')
+            self._plotContours(plt, contour97_5_T, contour97_5_Hs, 'r--', '95% bootstrap confidence interval')
+            self._plotContours(plt, contour2_5_T, contour2_5_Hs, 'r--', '_nolegend_')
+            self._plotContours(plt, contourmean_T, contourmean_Hs, 'r-', 'Mean bootstrap contour')
             plt.legend(loc='lower right', fontsize='small')
             plt.grid(True)
             plt.xlabel('Energy period, $T_e$ [s]')
@@ -306,7 +514,8 @@ class EA:
         return contourmean_Hs, contourmean_T
 
     def __getCopulaParams(self,n_size,bin_1_limit,bin_step):
-        sorted_idx = sorted(range(len(self.buoy.Hs)),key=lambda x:self.buoy.Hs[x])
+        # A stable sort keeps the order of equal Hs values
+        sorted_idx = np.argsort(self.buoy.Hs, kind='mergesort')
         Hs = self.buoy.Hs[sorted_idx]
         T = self.buoy.T[sorted_idx]
 
@@ -315,35 +524,43 @@ class EA:
         para_dist_1=stats.exponweib.fit(Hs,floc=0,fa=1)
         para_dist_2=stats.norm.fit(np.log(T))
 
-        # Binning
-        ind = np.array([])
-        ind = np.append(ind,sum(Hs_val <= bin_1_limit for Hs_val in Hs))
-        for i in range(1,200):
-            bin_i_limit = bin_1_limit+bin_step*(i)
-            ind = np.append(ind,sum(Hs_val <= bin_i_limit for Hs_val in Hs))
-            if (ind[i-0]-ind[i-1]) < n_size:
-                break
+        # Binning, ind[i] is the number of Hs values <= bin_1_limit+bin_step*i,
+        # up to the first bin holding less than n_size values
+        ind = np.searchsorted(Hs, bin_1_limit+bin_step*np.arange(200), side='right')
+        small = np.nonzero(np.diff(ind) < n_size)[0]
+        if len(small):
+            ind = ind[:small[0]+2]
 
         # Parameters for conditional distribution of T|Hs for each bin
         num=len(ind) # num+1: number of bins
-        para_dist_cond = []
-        hss = []
-
-        para_dist_cond.append(stats.norm.fit(np.log(T[range(0,int(ind[0]))])))  # parameters for first bin
-        hss.append(np.mean(Hs[range(0,int(ind[0])-1)])) # mean of Hs (component 1 for first bin)
-        para_dist_cond.append(stats.norm.fit(np.log(T[range(0,int(ind[1]))]))) # parameters for second bin
-        hss.append(np.mean(Hs[range(0,int(ind[1])-1)])) # mean of Hs (component 1 for second bin)
-
-        for i in range(2,num):
-            para_dist_cond.append(stats.norm.fit(np.log(T[range(int(ind[i-2]),int(ind[i]))])));
-            hss.append(np.mean(Hs[range(int(ind[i-2]),int(ind[i]))]))
+        # Count, mean and sum of squared deviations of log(T) in each bin,
+        # bin k holding the sorted values ind[k-1] to ind[k]
+        sizes = np.diff(np.concatenate(([0], ind, [len(Hs)])))
+        labels = np.repeat(np.arange(num+1), sizes)
+        count = sizes.astype(float)
+        logT = np.log(T)
+        mean_T = np.bincount(labels, logT, num+1)/np.maximum(count, 1)
+        m2_T = np.bincount(labels, (logT-mean_T[labels])**2, num+1)
+        sum_Hs = np.bincount(labels, Hs, num+1)
+
+        # The first fit uses the first bin, the others two consecutive bins:
+        # bins 0-1, then ind[i-2] to ind[i] and ind[num-2] to the end. The
+        # statistics of two bins are combined exactly.
+        count_ab = count[:-1]+count[1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = mean_T[1:]-mean_T[:-1]
+            mean_ab = mean_T[:-1]+delta*count[1:]/count_ab
+            m2_ab = m2_T[:-1]+m2_T[1:]+delta**2*count[:-1]*count[1:]/count_ab
+            para_dist_cond = np.column_stack((
+                np.append(mean_T[0], mean_ab),
+                np.sqrt(np.append(m2_T[0]/count[0], m2_ab/count_ab))))
+            hss = (sum_Hs[:-1]+sum_Hs[1:])/count_ab
+
+        # The means of Hs of the first two fits leave out their last value
+        hss = np.concatenate(([np.mean(Hs[:max(ind[0]-1, 0)]),
+                               np.mean(Hs[:max(ind[1]-1, 0)])], hss[1:]))
 
         # Estimate coefficient using least square solution (mean: third order, sigma: 2nd order)
-        para_dist_cond.append(stats.norm.fit(np.log(T[range(int(ind[num-2]),int(len(Hs)))])));  # parameters for last bin
-        hss.append(np.mean(Hs[range(int(ind[num-2]),int(len(Hs)))])) # mean of Hs (component 1 for last bin)
-
-        para_dist_cond = np.array(para_dist_cond)
-        hss = np.array(hss)
 
         phi_mean = np.column_stack((np.ones(num+1),hss[:],hss[:]**2,hss[:]**3))
         phi_std = np.column_stack((np.ones(num+1),hss[:],hss[:]**2))
@@ -384,12 +601,13 @@ class PCA(EA):
         self.coeff, self.shift, self.comp1_params, self.sigma_param, self.mu_param = self.__generateParams(size_bin)
 
     def __generateParams(self, size_bin=250.0):
+        from sklearn.decomposition import PCA as skPCA
         pca = skPCA(n_components=2)
         pca.fit(np.array((self.buoy.Hs - self.buoy.Hs.mean(axis=0), self.buoy.T - self.buoy.T.mean(axis=0))).T)
         coeff = abs(pca.components_)  # Apply correct/expected sign convention
         coeff[1, 1] = -1.0 * coeff[1, 1]  # Apply correct/expected sign convention
 
-        Comp1_Comp2 = np.dot (np.array((self.buoy.Hs, self.buoy.T)).T, coeff)
+        Comp1_Comp2 = np.column_stack(self.__princomp(self.buoy.Hs, self.buoy.T, coeff, 0.))
 
         shift = abs(min(Comp1_Comp2[:, 1])) + 0.1  # Calculate shift
 
@@ -437,6 +655,22 @@ class PCA(EA):
         groupObj.create_dataset('comp1_params', data=self.comp1_params)
         groupObj.create_dataset('sigma_param', data=self.sigma_param)
         groupObj.create_dataset('mu_param', data=self.mu_param)
+        groupObj.create_dataset('size_bin', data=self.size_bin)
+
+    def _loadParams(self, groupObj):
+        for name in ('nb_steps', 'time_r', 'time_ss', 'coeff', 'shift',
+                     'comp1_params', 'sigma_param', 'mu_param'):
+            setattr(self, name, groupObj[name][()])
+        # Not saved by earlier versions
+        if 'size_bin' in groupObj:
+            self.size_bin = groupObj['size_bin'][()]
+        else:
+            self.size_bin = 250.
+        self.Hs_SampleCA = None
+        self.Hs_SampleFSS = None
+        self.T_SampleCA = None
+        self.T_SampleFSS = None
+        self.Weight_points = None
 
     def getContours(self, time_ss, time_r, nb_steps=1000):
         '''WDRT Extreme Sea State PCA Contour function
@@ -450,7 +684,8 @@ class PCA(EA):
             Sea state duration (hours) of measurements in input.
         time_r : np.array
             Desired return period (years) for calculation of environmental
-            contour, can be a scalar or a vector.
+            contour, can be a scalar or a vector. The contours of all return
+            periods are computed together.
         nb_steps : float
             Discretization of the circle in the normal space used for
             inverse FORM calculation.
@@ -459,10 +694,13 @@ class PCA(EA):
         -------
         Hs_Return : np.array
             Calculated Hs values along the contour boundary following
-            return to original input orientation.
+            return to original input orientation. For several return
+            periods an array of shape (len(time_r), nb_steps), with one
+            contour per row.
         T_Return : np.array
            Calculated T values along the contour boundary following
-           return to original input orientation.
+           return to original input orientation, with the shape of
+           Hs_Return.
         nb_steps : float
             Discretization of the circle in the normal space
 
@@ -497,14 +735,7 @@ class PCA(EA):
         self.nb_steps = nb_steps
 
         # IFORM
-        # Failure probability for the desired return period (time_R) given the
-        # duration of the measurements (time_ss)
-        p_f = 1 / (365 * (24 / time_ss) * time_r)
-        beta = stats.norm.ppf((1 - p_f), loc=0, scale=1)  # Reliability
-        theta = np.linspace(0, 2 * np.pi, num = nb_steps)
-        # Vary U1, U2 along circle sqrt(U1^2+U2^2)=beta
-        U1 = beta * np.cos(theta)
-        U2 = beta * np.sin(theta)
+        U1, U2, shape = self._iformCircle(time_ss, time_r, nb_steps)
         # Calculate C1 values along the contour
         Comp1_R = stats.invgauss.ppf(stats.norm.cdf(U1, loc=0, scale=1),
                                      mu= self.comp1_params[0], loc=0,
@@ -519,7 +750,8 @@ class PCA(EA):
 
         # Calculate Hs and T along the contour
         Hs_Return, T_Return = self.__princomp_inv(Comp1_R, Comp2_R, self.coeff, self.shift)
-        Hs_Return = np.maximum(0, Hs_Return)  # Remove negative values
+        Hs_Return = np.maximum(0, Hs_Return, out=Hs_Return).reshape(shape)  # Remove negative values
+        T_Return = T_Return.reshape(shape)
         self.Hs_ReturnContours = Hs_Return
         self.T_ReturnContours = T_Return
         return Hs_Return, T_Return
@@ -586,17 +818,16 @@ class PCA(EA):
         Hs_zeroline = np.zeros(len(Te_zeroline))
 
         # Transform zero line into principal component space
-        Comp_zeroline = np.dot(np.transpose(np.vstack([Hs_zeroline, Te_zeroline])),
-                               self.coeff)
-        Comp_zeroline[:, 1] = Comp_zeroline[:, 1] + self.shift
+        C1_zeroline, C2_zeroline = self.__princomp(Hs_zeroline, Te_zeroline,
+                                                   self.coeff, self.shift)
 
         # Find quantiles along zero line
-        C1_zeroline_prob = stats.invgauss.cdf(Comp_zeroline[:, 0],
+        C1_zeroline_prob = stats.invgauss.cdf(C1_zeroline,
                                               mu = self.comp1_params[0], loc=0,
                                               scale = self.comp1_params[2])
-        mu_zeroline = self.__mu_fcn(Comp_zeroline[:, 0], self.mu_param[0], self.mu_param[1])
-        sigma_zeroline = self.__sigma_fcn(self.sigma_param, Comp_zeroline[:, 0])
-        C2_zeroline_prob = stats.norm.cdf(Comp_zeroline[:, 1],
+        mu_zeroline = self.__mu_fcn(C1_zeroline, self.mu_param[0], self.mu_param[1])
+        sigma_zeroline = self.__sigma_fcn(self.sigma_param, C1_zeroline)
+        C2_zeroline_prob = stats.norm.cdf(C2_zeroline,
                                           loc=mu_zeroline, scale=sigma_zeroline)
         C1_normzeroline = stats.norm.ppf(C1_zeroline_prob, 0, 1)
         C2_normzeroline = stats.norm.ppf(C2_zeroline_prob, 0, 1)
@@ -757,15 +988,48 @@ class PCA(EA):
         return sigma_fit
 
 
+    def __princomp(self, original1, original2, coeff, shift):
+        '''Rotates data into principal component space given coefficients,
+        and shift. Inverse of __princomp_inv.
+        Parameters
+        ----------
+        original1: np.array
+                   Array of Hs values, of any shape.
+        original2: np.array
+                   Array of T values, broadcastable with original1.
+        coeff: np.array
+               Array of principal component coefficients.
+        shift: float
+               Shift applied to Component 2 to make all values positive.
+        Returns
+        -------
+        princip_data1: np.array
+                       Component 1 values.
+        princip_data2: np.array
+                       Component 2 values.
+        '''
+        shape = np.broadcast(original1, original2).shape
+        princip_data1 = np.empty(shape)
+        princip_data2 = np.empty(shape)
+        np.multiply(original1, coeff[0, 0], out=princip_data1)
+        np.multiply(original1, coeff[0, 1], out=princip_data2)
+        # The products with T are formed in turn in a single buffer
+        scratch = np.empty(shape)
+        princip_data1 += np.multiply(original2, coeff[1, 0], out=scratch)
+        princip_data2 += np.multiply(original2, coeff[1, 1], out=scratch)
+        princip_data2 += shift
+        return princip_data1, princip_data2
+
     def __princomp_inv(self, princip_data1, princip_data2, coeff, shift):
         '''Takes the inverse of the principal component rotation given data,
         coefficients, and shift. Used in the EA and getSamples functions.
         Parameters
         ----------
         princip_data1: np.array
-                       Array of Component 1 values.
+                       Array of Component 1 values, of any shape.
         princip_data2: np.array
-                       Array of Component 2 values.
+                       Array of Component 2 values, broadcastable with
+                       princip_data1.
         coeff: np.array
                Array of principal component coefficients.
         shift: float
@@ -777,15 +1041,20 @@ class PCA(EA):
         original2: np.array
                    T values following rotation from principal component space.
         '''
-        original1 = np.zeros(len(princip_data1))
-        original2 = np.zeros(len(princip_data1))
-        for i in range(len(princip_data2)):
-            original1[i] = (((coeff[0, 1] * (princip_data2[i] - shift)) +
-                             (coeff[0, 0] * princip_data1[i])) / (coeff[0, 1]**2 +
-                                                                  coeff[0, 0]**2))
-            original2[i] = (((coeff[0, 1] * princip_data1[i]) -
-                             (coeff[0, 0] * (princip_data2[i] -
-                                             shift))) / (coeff[0, 1]**2 + coeff[0, 0]**2))
+        shape = np.broadcast(princip_data1, princip_data2).shape
+        norm = coeff[0, 1]**2 + coeff[0, 0]**2
+        original1 = np.empty(shape)
+        original2 = np.empty(shape)
+        # original2 holds Component 2 without its shift until it is needed
+        np.subtract(princip_data2, shift, out=original2)
+        np.multiply(original2, coeff[0, 1], out=original1)
+        scratch = np.empty(shape)
+        original1 += np.multiply(princip_data1, coeff[0, 0], out=scratch)
+        original1 /= norm
+        original2 *= coeff[0, 0]
+        np.multiply(princip_data1, coeff[0, 1], out=scratch)
+        np.subtract(scratch, original2, out=original2)
+        original2 /= norm
         return original1, original2
 
     def __betafcn(self, sig_p, rho):
@@ -916,7 +1185,8 @@ class PCA(EA):
 
 class GaussianCopula(EA):
 
-    def __init__(self, buoy, n_size=40., bin_1_limit=1., bin_step=0.25):
+    def __init__(self, buoy, n_size=40., bin_1_limit=1., bin_step=0.25,
+                 tau=None):
         '''
         Parameters
         ___________
@@ -930,6 +1200,9 @@ class GaussianCopula(EA):
                 maximum value of Hs for the first bin
             bin_step: float
                 overlap interval for each bin
+            tau: float (optional)
+                Kendall's tau of T and Hs, e.g. as saved by saveData. If
+                left blank it is computed from the buoy data.
         '''
         self.method = "Gaussian Copula"
         self.buoy = buoy
@@ -949,6 +1222,10 @@ class GaussianCopula(EA):
 
 #        self.coeff, self.shift, self.comp1_params, self.sigma_param, self.mu_param = self.__generateParams(size_bin)
         self.para_dist_1,self.para_dist_2,self.mean_cond,self.std_cond = self._EA__getCopulaParams(n_size,bin_1_limit,bin_step)
+        if tau is None:
+            tau = stats.kendalltau(self.buoy.T,self.buoy.Hs)[0] # Calculate Kendall's tau
+        self.tau = tau
+        self.rho_gau=np.sin(tau*np.pi/2.)
 
     def getContours(self, time_ss, time_r, nb_steps = 1000):
         '''WDRT Extreme Sea State Gaussian Copula Contour function
@@ -962,7 +1239,8 @@ class GaussianCopula(EA):
             Sea state duration (hours) of measurements in input.
         time_r : np.array
             Desired return period (years) for calculation of environmental
-            contour, can be a scalar or a vector.
+            contour, can be a scalar or a vector. The contours of all return
+            periods are computed together.
         nb_steps : float
             Discretization of the circle in the normal space used for
             inverse FORM calculation.
@@ -971,10 +1249,13 @@ class GaussianCopula(EA):
         -------
         Hs_Return : np.array
             Calculated Hs values along the contour boundary following
-            return to original input orientation.
+            return to original input orientation. For several return
+            periods an array of shape (len(time_r), nb_steps), with one
+            contour per row.
         T_Return : np.array
            Calculated T values along the contour boundary following
-           return to original input orientation.
+           return to original input orientation, with the shape of
+           Hs_Return.
         nb_steps : float
             Discretization of the circle in the normal space
 
@@ -1006,23 +1287,17 @@ class GaussianCopula(EA):
         self.time_r = time_r
         self.nb_steps = nb_steps
 
-        p_f = 1 / (365 * (24 / time_ss) * time_r)
-        beta = stats.norm.ppf((1 - p_f), loc=0, scale=1)  # Reliability
-        theta = np.linspace(0, 2 * np.pi, num = nb_steps)
-        # Vary U1, U2 along circle sqrt(U1^2+U2^2)=beta
-        U1 = beta * np.cos(theta)
-        U2 = beta * np.sin(theta)
+        U1, U2, shape = self._iformCircle(time_ss, time_r, nb_steps)
 
         comp_1 = stats.exponweib.ppf(stats.norm.cdf(U1),a=self.para_dist_1[0],c=self.para_dist_1[1],loc=self.para_dist_1[2],scale=self.para_dist_1[3])
 
-        tau = stats.kendalltau(self.buoy.T,self.buoy.Hs)[0] # Calculate Kendall's tau
-        rho_gau=np.sin(tau*np.pi/2.)
+        rho_gau = self.rho_gau
 
         z2_Gau=stats.norm.cdf(U2*np.sqrt(1.-rho_gau**2.)+rho_gau*U1);
         comp_2_Gaussian = stats.lognorm.ppf(z2_Gau,s=self.para_dist_2[1],loc=0,scale=np.exp(self.para_dist_2[0])) #lognormalinverse
 
-        Hs_Return = comp_1
-        T_Return = comp_2_Gaussian
+        Hs_Return = comp_1.reshape(shape)
+        T_Return = comp_2_Gaussian.reshape(shape)
 
         self.Hs_ReturnContours = Hs_Return
         self.T_ReturnContours = T_Return
@@ -1039,6 +1314,19 @@ class GaussianCopula(EA):
         groupObj.create_dataset('para_dist_2', data=self.para_dist_2)
         groupObj.create_dataset('mean_cond', data=self.mean_cond)
         groupObj.create_dataset('std_cond', data=self.std_cond)
+        groupObj.create_dataset('tau', data=self.tau)
+        groupObj.create_dataset('rho_gau', data=self.rho_gau)
+
+    def _loadParams(self, groupObj):
+        for name in ('n_size', 'bin_1_limit', 'bin_step', 'para_dist_1',
+                     'para_dist_2', 'mean_cond', 'std_cond'):
+            setattr(self, name, groupObj[name][()])
+        # Not saved by earlier versions
+        self.tau = self._loadTau(groupObj)
+        if 'rho_gau' in groupObj:
+            self.rho_gau = groupObj['rho_gau'][()]
+        else:
+            self.rho_gau = np.sin(self.tau*np.pi/2.)
 
 
 class Rosenblatt(EA):
@@ -1088,7 +1376,8 @@ class Rosenblatt(EA):
             Sea state duration (hours) of measurements in input.
         time_r : np.array
             Desired return period (years) for calculation of environmental
-            contour, can be a scalar or a vector.
+            contour, can be a scalar or a vector. The contours of all return
+            periods are computed together.
         nb_steps : float
             Discretization of the circle in the normal space used for
             inverse FORM calculation.
@@ -1097,10 +1386,13 @@ class Rosenblatt(EA):
         -------
         Hs_Return : np.array
             Calculated Hs values along the contour boundary following
-            return to original input orientation.
+            return to original input orientation. For several return
+            periods an array of shape (len(time_r), nb_steps), with one
+            contour per row.
         T_Return : np.array
            Calculated T values along the contour boundary following
-           return to original input orientation.
+           return to original input orientation, with the shape of
+           Hs_Return.
         nb_steps : float
             Discretization of the circle in the normal space
 
@@ -1133,12 +1425,7 @@ class Rosenblatt(EA):
         self.time_r = time_r
         self.nb_steps = nb_steps
 
-        p_f = 1 / (365 * (24 / time_ss) * time_r)
-        beta = stats.norm.ppf((1 - p_f), loc=0, scale=1)  # Reliability
-        theta = np.linspace(0, 2 * np.pi, num = nb_steps)
-        # Vary U1, U2 along circle sqrt(U1^2+U2^2)=beta
-        U1 = beta * np.cos(theta)
-        U2 = beta * np.sin(theta)
+        U1, U2, shape = self._iformCircle(time_ss, time_r, nb_steps)
 
         comp_1 = stats.exponweib.ppf(stats.norm.cdf(U1),a=self.para_dist_1[0],c=self.para_dist_1[1],loc=self.para_dist_1[2],scale=self.para_dist_1[3])
 
@@ -1147,8 +1434,8 @@ class Rosenblatt(EA):
 
         comp_2_Rosenblatt = stats.lognorm.ppf(stats.norm.cdf(U2),s=sigma_cond,loc=0,scale=np.exp(lamda_cond))  # lognormal inverse
 
-        Hs_Return = comp_1
-        T_Return = comp_2_Rosenblatt
+        Hs_Return = comp_1.reshape(shape)
+        T_Return = comp_2_Rosenblatt.reshape(shape)
 
         self.Hs_ReturnContours = Hs_Return
         self.T_ReturnContours = T_Return
@@ -1166,9 +1453,15 @@ class Rosenblatt(EA):
         groupObj.create_dataset('mean_cond', data=self.mean_cond)
         groupObj.create_dataset('std_cond', data=self.std_cond)
 
+    def _loadParams(self, groupObj):
+        for name in ('n_size', 'bin_1_limit', 'bin_step', 'para_dist_1',
+                     'para_dist_2', 'mean_cond', 'std_cond'):
+            setattr(self, name, groupObj[name][()])
+
 
 class ClaytonCopula(EA):
-    def __init__(self, buoy, n_size=40., bin_1_limit=1., bin_step=0.25):
+    def __init__(self, buoy, n_size=40., bin_1_limit=1., bin_step=0.25,
+                 tau=None):
         '''
         Parameters
         ___________
@@ -1182,6 +1475,9 @@ class ClaytonCopula(EA):
                 maximum value of Hs for the first bin
             bin_step: float
                 overlap interval for each bin
+            tau: float (optional)
+                Kendall's tau of T and Hs, e.g. as saved by saveData. If
+                left blank it is computed from the buoy data.
         '''
         self.method = "Clayton Copula"
         self.buoy = buoy
@@ -1201,6 +1497,10 @@ class ClaytonCopula(EA):
 
 #        self.coeff, self.shift, self.comp1_params, self.sigma_param, self.mu_param = self.__generateParams(size_bin)
         self.para_dist_1,self.para_dist_2,self.mean_cond,self.std_cond = self._EA__getCopulaParams(n_size,bin_1_limit,bin_step)
+        if tau is None:
+            tau = stats.kendalltau(self.buoy.T,self.buoy.Hs)[0] # Calculate Kendall's tau
+        self.tau = tau
+        self.theta_clay = (2.*tau)/(1.-tau)
 
     def getContours(self, time_ss, time_r, nb_steps = 1000):
         '''WDRT Extreme Sea State Clayton Copula Contour function
@@ -1214,7 +1514,8 @@ class ClaytonCopula(EA):
             Sea state duration (hours) of measurements in input.
         time_r : np.array
             Desired return period (years) for calculation of environmental
-            contour, can be a scalar or a vector.
+            contour, can be a scalar or a vector. The contours of all return
+            periods are computed together.
         nb_steps : float
             Discretization of the circle in the normal space used for
             inverse FORM calculation.
@@ -1223,10 +1524,13 @@ class ClaytonCopula(EA):
         -------
         Hs_Return : np.array
             Calculated Hs values along the contour boundary following
-            return to original input orientation.
+            return to original input orientation. For several return
+            periods an array of shape (len(time_r), nb_steps), with one
+            contour per row.
         T_Return : np.array
            Calculated T values along the contour boundary following
-           return to original input orientation.
+           return to original input orientation, with the shape of
+           Hs_Return.
         nb_steps : float
             Discretization of the circle in the normal space
 
@@ -1259,23 +1563,17 @@ class ClaytonCopula(EA):
         self.time_r = time_r
         self.nb_steps = nb_steps
 
-        p_f = 1 / (365 * (24 / time_ss) * time_r)
-        beta = stats.norm.ppf((1 - p_f), loc=0, scale=1)  # Reliability
-        theta = np.linspace(0, 2 * np.pi, num = nb_steps)
-        # Vary U1, U2 along circle sqrt(U1^2+U2^2)=beta
-        U1 = beta * np.cos(theta)
-        U2 = beta * np.sin(theta)
+        U1, U2, shape = self._iformCircle(time_ss, time_r, nb_steps)
 
         comp_1 = stats.exponweib.ppf(stats.norm.cdf(U1),a=self.para_dist_1[0],c=self.para_dist_1[1],loc=self.para_dist_1[2],scale=self.para_dist_1[3])
 
-        tau = stats.kendalltau(self.buoy.T,self.buoy.Hs)[0] # Calculate Kendall's tau
-        theta_clay = (2.*tau)/(1.-tau)
+        theta_clay = self.theta_clay
 
         z2_Clay=((1.-stats.norm.cdf(U1)**(-theta_clay)+stats.norm.cdf(U1)**(-theta_clay)/stats.norm.cdf(U2))**(theta_clay/(1.+theta_clay)))**(-1./theta_clay)
         comp_2_Clayton = stats.lognorm.ppf(z2_Clay,s=self.para_dist_2[1],loc=0,scale=np.exp(self.para_dist_2[0])) #lognormalinverse
 
-        Hs_Return = comp_1
-        T_Return = comp_2_Clayton
+        Hs_Return = comp_1.reshape(shape)
+        T_Return = comp_2_Clayton.reshape(shape)
 
         self.Hs_ReturnContours = Hs_Return
         self.T_ReturnContours = T_Return
@@ -1292,10 +1590,28 @@ class ClaytonCopula(EA):
         groupObj.create_dataset('para_dist_2', data=self.para_dist_2)
         groupObj.create_dataset('mean_cond', data=self.mean_cond)
         groupObj.create_dataset('std_cond', data=self.std_cond)
+        groupObj.create_dataset('tau', data=self.tau)
+        groupObj.create_dataset('theta_clay', data=self.theta_clay)
+
+    def _loadParams(self, groupObj):
+        for name in ('n_size', 'bin_1_limit', 'bin_step', 'para_dist_1',
+                     'para_dist_2', 'mean_cond', 'std_cond'):
+            setattr(self, name, groupObj[name][()])
+        # Not saved by earlier versions
+        self.tau = self._loadTau(groupObj)
+        if 'theta_clay' in groupObj:
+            self.theta_clay = groupObj['theta_clay'][()]
+        else:
+            self.theta_clay = (2.*self.tau)/(1.-self.tau)
+
+
+# Number of copula density values GumbelCopula.getContours evaluates at once
+_GUMBEL_BLOCK_SIZE = 2**20
 
 
 class GumbelCopula(EA):
-    def __init__(self, buoy, n_size=40., bin_1_limit=1., bin_step=0.25,Ndata = 1000):
+    def __init__(self, buoy, n_size=40., bin_1_limit=1., bin_step=0.25,Ndata = 1000,
+                 tau=None, engine='grid'):
         '''
         Parameters
         ___________
@@ -1309,8 +1625,23 @@ class GumbelCopula(EA):
                 maximum value of Hs for the first bin
             bin_step: float
                 overlap interval for each bin
+            Ndata: int
+                discretization of T used to invert the conditional
+                distribution
+            tau: float (optional)
+                Kendall's tau of T and Hs, e.g. as saved by saveData. If
+                left blank it is computed from the buoy data.
+            engine: string
+                Inversion of the conditional distribution of T given Hs.
+                'grid' integrates the copula density on Ndata values of T,
+                'hfunction' inverts the closed form conditional
+                distribution of the copula (h-function) to a tolerance of
+                1e-12 and does not use Ndata.
         '''
+        if engine not in ('grid', 'hfunction'):
+            raise ValueError("engine must be 'grid' or 'hfunction'")
         self.method = "Gumbel Copula"
+        self.engine = engine
         self.buoy = buoy
         self.n_size = n_size
         self.bin_1_limit = bin_1_limit
@@ -1329,6 +1660,10 @@ class GumbelCopula(EA):
         self.min_limit_2 = 0.
         self.max_limit_2 = np.ceil(np.amax(self.buoy.T)*2)
         self.para_dist_1,self.para_dist_2,self.mean_cond,self.std_cond = self._EA__getCopulaParams(n_size,bin_1_limit,bin_step)
+        if tau is None:
+            tau = stats.kendalltau(self.buoy.T,self.buoy.Hs)[0] # Calculate Kendall's tau
+        self.tau = tau
+        self.theta_gum = 1./(1.-tau)
 
     def getContours(self, time_ss, time_r, nb_steps = 1000):
         '''WDRT Extreme Sea State Gumbel Copula Contour function
@@ -1342,7 +1677,8 @@ class GumbelCopula(EA):
             Sea state duration (hours) of measurements in input.
         time_r : np.array
             Desired return period (years) for calculation of environmental
-            contour, can be a scalar or a vector.
+            contour, can be a scalar or a vector. The contours of all return
+            periods are computed together.
         nb_steps : float
             Discretization of the circle in the normal space used for
             inverse FORM calculation.
@@ -1351,10 +1687,13 @@ class GumbelCopula(EA):
         -------
         Hs_Return : np.array
             Calculated Hs values along the contour boundary following
-            return to original input orientation.
+            return to original input orientation. For several return
+            periods an array of shape (len(time_r), nb_steps), with one
+            contour per row.
         T_Return : np.array
            Calculated T values along the contour boundary following
-           return to original input orientation.
+           return to original input orientation, with the shape of
+           Hs_Return.
         nb_steps : float
             Discretization of the circle in the normal space
 
@@ -1387,46 +1726,42 @@ class GumbelCopula(EA):
         self.time_r = time_r
         self.nb_steps = nb_steps
 
-        p_f = 1 / (365 * (24 / time_ss) * time_r)
-        beta = stats.norm.ppf((1 - p_f), loc=0, scale=1)  # Reliability
-        theta = np.linspace(0, 2 * np.pi, num = nb_steps)
-        # Vary U1, U2 along circle sqrt(U1^2+U2^2)=beta
-        U1 = beta * np.cos(theta)
-        U2 = beta * np.sin(theta)
+        U1, U2, shape = self._iformCircle(time_ss, time_r, nb_steps)
 
         comp_1 = stats.exponweib.ppf(stats.norm.cdf(U1),a=self.para_dist_1[0],c=self.para_dist_1[1],loc=self.para_dist_1[2],scale=self.para_dist_1[3])
 
-        tau = stats.kendalltau(self.buoy.T,self.buoy.Hs)[0] # Calculate Kendall's tau
-        theta_gum = 1./(1.-tau)
+        theta_gum = self.theta_gum
 
         fi_u1=stats.norm.cdf(U1);
         fi_u2=stats.norm.cdf(U2);
-        x2 = np.linspace(self.min_limit_2,self.max_limit_2,self.Ndata)
-        z2 = stats.lognorm.cdf(x2,s=self.para_dist_2[1],loc=0,scale=np.exp(self.para_dist_2[0]))
-
-        comp_2_Gumb = np.zeros(nb_steps)
-        for k in range(0,int(nb_steps)):
-            z1 = np.linspace(fi_u1[k],fi_u1[k],self.Ndata)
-            Z = np.array((z1,z2))
-            Y = self.__gumbelCopula(Z, theta_gum) # Copula density function
-            Y =np.nan_to_num(Y)
-            p_x2_x1 = Y*(stats.lognorm.pdf(x2, s = self.para_dist_2[1], loc=0, scale = np.exp(self.para_dist_2[0]))) # pdf 2|1, f(comp_2|comp_1)=c(z1,z2)*f(comp_2)
-            dum = np.cumsum(p_x2_x1)
-            cdf = dum/(dum[self.Ndata-1]) # Estimate CDF from PDF
-            table = np.array((x2, cdf)) # Result of conditional CDF derived based on Gumbel copula
-            table = table.T
-            for j in range(self.Ndata):
-                if fi_u2[k] <= table[0,1]:
-                    comp_2_Gumb[k] = min(table[:,0])
-                    break
-                elif fi_u2[k] <= table[j,1]:
-                    comp_2_Gumb[k] = (table[j,0]+table[j-1,0])/2
-                    break
-                else:
-                    comp_2_Gumb[k] = table[:,0].max()
-
-        Hs_Return = comp_1
-        T_Return = comp_2_Gumb
+        if self.engine == 'hfunction':
+            # Probability of T such that the conditional CDF of T given Hs
+            # equals fi_u2, given as -log(z2) so values near 1 keep their
+            # precision
+            nlog_z2 = self.__gumbelHInverse(fi_u1, fi_u2, theta_gum)
+            comp_2_Gumb = stats.lognorm.isf(-np.expm1(-nlog_z2),s=self.para_dist_2[1],loc=0,scale=np.exp(self.para_dist_2[0]))
+        else:
+            x2 = np.linspace(self.min_limit_2,self.max_limit_2,self.Ndata)
+            z2 = stats.lognorm.cdf(x2,s=self.para_dist_2[1],loc=0,scale=np.exp(self.para_dist_2[0]))
+
+            pdf_2 = stats.lognorm.pdf(x2, s = self.para_dist_2[1], loc=0, scale = np.exp(self.para_dist_2[0]))
+
+            comp_2_Gumb = np.zeros(len(fi_u1))
+            # The conditional CDFs of a block of contour points are evaluated
+            # together, one row per point, bounding the memory used
+            block = max(1, _GUMBEL_BLOCK_SIZE // self.Ndata)
+            for start in range(0, len(fi_u1), block):
+                stop = start + block
+                Z = np.array(np.broadcast_arrays(fi_u1[start:stop, np.newaxis], z2))
+                Y = self.__gumbelCopula(Z, theta_gum) # Copula density function
+                Y =np.nan_to_num(Y)
+                p_x2_x1 = Y*pdf_2 # pdf 2|1, f(comp_2|comp_1)=c(z1,z2)*f(comp_2)
+                dum = np.cumsum(p_x2_x1, axis=1)
+                cdf = dum/dum[:, -1:] # Estimate CDF from PDF
+                comp_2_Gumb[start:stop] = _invertCDF(x2, cdf, fi_u2[start:stop])
+
+        Hs_Return = comp_1.reshape(shape)
+        T_Return = comp_2_Gumb.reshape(shape)
 
         self.Hs_ReturnContours = Hs_Return
         self.T_ReturnContours = T_Return
@@ -1446,14 +1781,33 @@ class GumbelCopula(EA):
         groupObj.create_dataset('para_dist_2', data=self.para_dist_2)
         groupObj.create_dataset('mean_cond', data=self.mean_cond)
         groupObj.create_dataset('std_cond', data=self.std_cond)
+        groupObj.create_dataset('tau', data=self.tau)
+        groupObj.create_dataset('theta_gum', data=self.theta_gum)
+        groupObj.create_dataset('engine', data=self.engine)
+
+    def _loadParams(self, groupObj):
+        for name in ('Ndata', 'min_limit_2', 'max_limit_2', 'n_size',
+                     'bin_1_limit', 'bin_step', 'para_dist_1', 'para_dist_2',
+                     'mean_cond', 'std_cond'):
+            setattr(self, name, groupObj[name][()])
+        # Not saved by earlier versions
+        self.tau = self._loadTau(groupObj)
+        if 'theta_gum' in groupObj:
+            self.theta_gum = groupObj['theta_gum'][()]
+        else:
+            self.theta_gum = 1./(1.-self.tau)
+        if 'engine' in groupObj:
+            self.engine = groupObj['engine'][()]
+        else:
+            self.engine = 'grid'
 
     def __gumbelCopula(self, u, alpha):
         ''' Calculates the Gumbel copula density
         Parameters
         ----------
         u: np.array
-                    Vector of equally spaced points between 0 and twice the
-                    maximum value of T.
+                    Pairs of points (u1, u2) stacked along the first axis,
+                    any further axes are kept in the result.
        alpha: float
                     Copula parameter. Must be greater than or equal to 1.
         Returns
@@ -1462,17 +1816,62 @@ class GumbelCopula(EA):
                    Copula density function.
         '''
         #Ignore divide by 0 warnings and resulting NaN warnings
-        np.seterr(all='ignore')        
-        v = -np.log(u)
-        v = np.sort(v, axis=0)
-        vmin = v[0, :]
-        vmax = v[1, :]
-        nlogC = vmax * (1 + (vmin / vmax) ** alpha) ** (1 / alpha)
-        y = (alpha - 1 +nlogC)*np.exp(-nlogC+np.sum((alpha-1)*np.log(v)+v, axis =0) +(1-2*alpha)*np.log(nlogC))
-        np.seterr(all='warn')
+        with np.errstate(all='ignore'):
+            v = -np.log(u)
+            v = np.sort(v, axis=0)
+            vmin = v[0]
+            vmax = v[1]
+            nlogC = vmax * (1 + (vmin / vmax) ** alpha) ** (1 / alpha)
+            y = (alpha - 1 +nlogC)*np.exp(-nlogC+np.sum((alpha-1)*np.log(v)+v, axis =0) +(1-2*alpha)*np.log(nlogC))
 
         return(y)
 
+    def __gumbelHInverse(self, u1, u2, alpha, tol=1e-12):
+        ''' Inverts the conditional distribution (h-function) of the Gumbel
+        copula, h(z2|u1) = dC(u1,z2)/du1, for all points at once.
+        Parameters
+        ----------
+        u1: np.array
+                    Probabilities of the conditioning variable.
+        u2: np.array
+                    Conditional probabilities, same shape as u1.
+        alpha: float
+                    Copula parameter. Must be greater than or equal to 1.
+        tol: float
+                    Tolerance on log(-log(z2)).
+        Returns
+        -------
+        y: np.array
+                   -log(z2), where h(z2|u1) = u2.
+        '''
+        # With x = -log(u1) and y = -log(z2), A = x**alpha + y**alpha and
+        # log h = x - A**(1/alpha) + (alpha-1)*log(x) + (1/alpha-1)*log(A),
+        # which decreases with t = log(y). t is found by bisection.
+        with np.errstate(all='ignore'):
+            x = -np.log(u1)
+            logx = np.log(x)
+            logu2 = np.log(u2)
+            lo = np.full(np.shape(u1), -40.)
+            hi = np.full(np.shape(u1), 40.)
+            for _ in range(int(np.ceil(np.log2(80. / tol)))):
+                t = 0.5 * (lo + hi)
+                logA = np.logaddexp(alpha * logx, alpha * t)
+                logh = (x - np.exp(logA / alpha) + (alpha - 1) * logx +
+                        (1. / alpha - 1) * logA)
+                above = logh > logu2
+                lo = np.where(above, t, lo)
+                hi = np.where(above, hi, t)
+            y = np.exp(0.5 * (lo + hi))
+        return(y)
+
+
+# Contour model classes by the method name saveData writes
+_EA_METHODS = {"Principle component analysis": PCA,
+               "Gaussian Copula": GaussianCopula,
+               "Rosenblatt": Rosenblatt,
+               "Clayton Copula": ClaytonCopula,
+               "Gumbel Copula": GumbelCopula}
+
 
 class Buoy:
     '''
@@ -1492,7 +1891,24 @@ class Buoy:
     T : list
         Energy period.
     dateNum : list
-        List of datetime objects.
+        Date of each sea state as a proleptic Gregorian ordinal, with the
+        time of day as the fractional part.
+    spectralParams : dict
+        Additional sea state parameters computed by getSpectralParams, keyed
+        by parameter name. Each array lines up with Hs, T and dateNum.
+    freqGrid : np.array
+        Common frequency grid of swdMatrix, set by harmonizeFrequencies.
+    swdMatrix : np.array
+        Spectral wave density of every sea state on freqGrid, one row per
+        sea state lining up with Hs, T and dateNum. Set by
+        harmonizeFrequencies.
+    qcLimits : dict
+        Lower (excluded) and upper (included) limits of the physically
+        plausible values of Hs [m] and Te [s], see _qualityControl.
+    qcCounts : dict
+        Number of records read and rejected by each quality control rule
+        for each year loaded by loadFromText or fetchFromWeb, keyed by year
+        (e.g. "2004b") and then by rule name or "records".
     '''
 
 
@@ -1515,6 +1931,11 @@ class Buoy:
         self.Hs = []
         self.T = []
         self.dateNum = []
+        self.spectralParams = {}
+        self.freqGrid = None
+        self.swdMatrix = None
+        self.qcLimits = dict(_QC_LIMITS)
+        self.qcCounts = {}
 
         self.buoyNum = buoyNum
         self.savePath = savePath
@@ -1525,7 +1946,9 @@ class Buoy:
 
 
 
-    def fetchFromWeb(self, saveType="txt", savePath=None):
+    def fetchFromWeb(self, saveType="txt", savePath=None, workers=1,
+                     baseURL="http://www.ndbc.noaa.gov", proxy=None,
+                     incremental=True, cache=False, compressed=False):
 
         '''Searches ndbc.noaa.gov for the historical spectral wave density
         data of a given device and writes the annual files from the website
@@ -1535,12 +1958,39 @@ class Buoy:
         Parameters
         ----------
         saveType: string
-            If set to to "h5", the data will be saved in a compressed .h5
-            file
+            If set to to "h5", the data will be appended to the compressed
+            .h5 spectral archive of the buoy, see saveSpectra
             If set to "txt", the data will be stored in a raw .txt file
             Otherwise, a file will not be created
         savePath : string
             Relative path to place directory with data files.
+        workers : int (optional)
+            Number of annual files downloaded concurrently. If left blank the
+            files are downloaded one after another.
+        baseURL : string (optional)
+            Root URL of the NDBC website, may point to a mirror or a local
+            server.
+        proxy : string (optional)
+            HTTP proxy used for all requests, e.g.
+            "http://wwwproxy.sandia.gov:80". If left blank no proxy is used.
+        incremental : boolean (optional)
+            Only used if saveType is "txt". Files recorded in the manifest of
+            the save directory are reused: years before the current one are
+            read from disk without contacting the server, and other years are
+            only downloaded again if their ETag changed. An interrupted fetch
+            resumes with the files that were not completed. If set to False
+            every file is downloaded again.
+        cache : boolean (optional)
+            Only used if saveType is "txt". If True, Hs, T and dateNum are
+            stored in the cache of derived data (see loadFromText) and are
+            returned from it, without reading the files, when no file has
+            changed. In that case swdList, freqList and dateList are left
+            empty, and getSpectralParams and harmonizeFrequencies raise a
+            ValueError.
+        compressed : boolean (optional)
+            If True the gzip-compressed annual files are downloaded instead
+            of the text files, and saved as SWD-<buoyNum>-<year>.txt.gz if
+            saveType is "txt". They are decompressed in memory only.
 
         Returns
         ---------
@@ -1551,17 +2001,14 @@ class Buoy:
         >>> buoy = ESSC.Buoy(46022)
         >>> buoy.fetchFromWeb()
         '''
-        numLines = 0
-        numCols = 0
-        numDates = 0
-        dateVals = []
-        spectralVals = []
+        import bs4
         numYears= 0
         if savePath == None:
             savePath = self.savePath
 
-        url = "http://www.ndbc.noaa.gov/station_history.php?station=%s" % (self.buoyNum)
-        ndbcURL = requests.get(url,proxies = {"http":"http://wwwproxy.sandia.gov:80"})
+        session = _ndbcSession(workers, proxy)
+        url = "%s/station_history.php?station=%s" % (baseURL, self.buoyNum)
+        ndbcURL = session.get(url)
         ndbcURL.raise_for_status()
         ndbcHTML = bs4.BeautifulSoup(ndbcURL.text, "lxml")
         headers = ndbcHTML.findAll("b", text="Spectral wave density data: ")
@@ -1579,110 +2026,133 @@ class Buoy:
 
         if(saveType is 'txt'):
             # Grab the device number so the filename is more specific
-            saveDir = os.path.join(self.savePath, 'NDBC%s' % (self.buoyNum))
+            saveDir = os.path.join(savePath, 'NDBC%s' % (self.buoyNum))
             print "Saving in :", saveDir
             if not os.path.exists(saveDir):
                 os.makedirs(saveDir)
 
         if(saveType is "h5"):
-            saveDir = os.path.join(self.savePath, 'NDBC%s-raw.h5' %(self.buoyNum))
+            saveDir = os.path.join(savePath, 'NDBC%s-raw.h5' %(self.buoyNum))
             print "Saving in :", saveDir
-            f = h5py.File(saveDir, 'w')
+            import h5py
+            f = h5py.File(saveDir, 'a')
+            gsp = f.require_group('spectra')
 
+        # The manifest records every text file written, so later calls can
+        # skip years that are already complete on disk
+        manifest = {}
+        if(saveType is 'txt'):
+            manifest = _loadManifest(saveDir)
+        currentYear = datetime.now().year
+
+        results = {}
+        rereads = {}
+        downloads = []
+        dataSetNames = []
         for link in links:
             numYears += 1
-            dataLink = "http://ndbc.noaa.gov" + link
+            dataLink = baseURL + link
             year = int(re.findall("[0-9]+", link)[1])
-            if(saveType is 'txt'):
             #certain years have multiple files marked with the letter 'b'
-                if ('b' + str(year)) not in link:
-                    swdFile = open(os.path.join(saveDir, "SWD-%s-%d.txt" %
-                                   (self.buoyNum, year)), 'w')
-                else:
-                    swdFile = open(os.path.join(saveDir, "SWD-%s-%s.txt" %
-                                   (self.buoyNum, str(year) + 'b')), 'w')
-
-            if(saveType is 'h5'):
-                if ('b' + str(year)) not in link:
-                    dataSetName = str(("SWD-%s-%d" %
-                                   (self.buoyNum, year)))
-                else:
-                    dataSetName = str(("SWD-%s-%s" %
-                                   (self.buoyNum, str(year) + 'b')))
-                    numYears -= 1
-
-
-            fileName = dataLink.replace('download_data', 'view_text_file')
-            data = urllib2.urlopen(fileName)
-            print "Reading from:", data.geturl()
-
-
-
-            #First Line of every file contains the frequency data
-            frequency = data.readline()
-            if frequency.split()[4] == 'mm':
-                numDates = 5
-
+            if ('b' + str(year)) not in link:
+                dataSetName = "SWD-%s-%d" % (self.buoyNum, year)
             else:
-                numDates = 4
-
-            if (saveType is "txt"):
-                swdFile.write(frequency)
-            frequency = np.array(frequency.split()[numDates:], dtype = np.float)
-
-
-            for line in data:
-                if (saveType is "txt"):
-                    swdFile.write(line)
-                currentLine = line.split()
-                numCols = len(currentLine)
-                if numCols - numDates != len(frequency):
-                    print "Corrupted NDBC File - Skipping"
-                    swdFile.close()
-                    os.remove(swdFile.name)
-                    spectralVals = []
-                    dateVals = []
+                dataSetName = "SWD-%s-%s" % (self.buoyNum, str(year) + 'b')
+                if(saveType is 'h5'):
                     numYears -= 1
-                    break
-
-                if float(currentLine[numDates+1]) < 999:
-                    numLines += 1
-                    for j in range(numDates):
-                        dateVals.append(currentLine[j])
-                    for j in range(numCols - numDates):
-                        spectralVals.append(currentLine[j + numDates])
-
-            if len(spectralVals) != 0:
-                dateValues = np.array(dateVals, dtype=np.int)
-                spectralValues = np.array(spectralVals, dtype=np.float)
-
-                dateValues = np.reshape(dateValues, (numLines, numDates))
-                spectralValues = np.reshape(spectralValues, (numLines,
-                                                             (numCols - numDates)))
-
-
-
-
-            numLines = 0
-            numCols = 0
-
-            if len(spectralVals) != 0:
+            dataSetNames.append(dataSetName)
+
+            extension = ".txt.gz"
+            fileName = dataLink
+            if not compressed:
+                extension = ".txt"
+                fileName = dataLink.replace('download_data', 'view_text_file')
+            swdFileName = None
+            entry = None
+            if(saveType is 'txt'):
+                swdFileName = os.path.join(saveDir, dataSetName + extension)
+                entry = manifest.get(dataSetName)
+                if (not incremental or entry is None or entry['link'] != fileName
+                        or not os.path.exists(swdFileName)):
+                    entry = None
+
+            download = (session, fileName, swdFileName, dataSetName,
+                        self.qcLimits, entry)
+            if (entry is not None and year < currentYear and
+                    os.path.getsize(swdFileName) == entry['size']):
+                # Historical years no longer change once complete, they are
+                # only read once it is known the data are needed
+                results[dataSetName] = _ON_DISK
+                rereads[dataSetName] = download[:-1] + (None,)
+                continue
+            downloads.append(download)
+
+        def record(fetched):
+            dataSetName, result, entry = fetched
+            results[dataSetName] = result
+            if(saveType is 'txt'):
+                if entry is None:
+                    manifest.pop(dataSetName, None)
+                else:
+                    manifest[dataSetName] = entry
+                _saveManifest(saveDir, manifest)
+
+        if workers > 1 and len(downloads) > 1:
+            # Downloads are I/O bound, so threads sharing the session suffice
+            pool = ThreadPool(min(workers, len(downloads)))
+            try:
+                for fetched in pool.imap_unordered(_fetchSWD, downloads):
+                    record(fetched)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for download in downloads:
+                record(_fetchSWD(download))
+        for download in downloads:
+            rereads[download[3]] = download[:-1] + (None,)
+
+        if cache and saveType is 'txt':
+            cacheDir = os.path.join(savePath, 'cache')
+            key = _cacheKey([(manifest[name]['file'], manifest[name]['sha1'])
+                             for name in dataSetNames if name in manifest],
+                            self._cacheOptions())
+            if self._loadCache(cacheDir, key):
+                return numYears - sum(results[name] is None
+                                      for name in dataSetNames)
+
+        for dataSetName in dataSetNames:
+            result = results[dataSetName]
+            if result is _ON_DISK:
+                fileName = rereads[dataSetName][2]
+                print "Reading from:", fileName
+                result = _readCachedSWD(fileName, manifest[dataSetName],
+                                        self.qcLimits)
+                if result is None:
+                    # The file changed on disk, download it again
+                    record(_fetchSWD(rereads[dataSetName]))
+                    result = results[dataSetName]
+            if result is None:
+                numYears -= 1
+                continue
+            frequency, dateValues, spectralValues, counts = result
+            self.qcCounts[dataSetName.split('-')[-1]] = counts
+
+            if len(spectralValues) != 0:
                 if(saveType is "h5"):
-                    f.create_dataset(str(dataSetName) + "-date_values", data = dateValues,compression = "gzip")
-                    f.create_dataset(str(dataSetName + "-frequency"),data=frequency,compression = "gzip")
-                    f.create_dataset(dataSetName,data=spectralValues,compression = "gzip")
-                del dateVals[:]
-                del spectralVals[:]
+                    _appendSpectra(gsp, frequency, dateValues, spectralValues)
                 self.swdList.append(spectralValues)
                 self.freqList.append(frequency)
                 self.dateList.append(dateValues)
 
-                if(saveType is "txt"):
-                    swdFile.close()
+        if(saveType is "h5"):
+            f.close()
         self._prepData()
+        if cache and saveType is 'txt':
+            _saveCache(cacheDir, key, self)
         return numYears
 
-    def loadFromText(self, dirPath=None):
+    def loadFromText(self, dirPath=None, workers=1, cache=False):
         '''Loads NDBC data previously downloaded to a series of text files in the
         specified directory.
 
@@ -1690,9 +2160,21 @@ class Buoy:
         ----------
             dirPath : string
                 Relative path to directory containing NDBC text files (created by
-                NBDCdata.fetchFromWeb). If left blank, the method will search
-                all directories for the data using the current directory as
-                the root.
+                NBDCdata.fetchFromWeb), plain or gzip-compressed (.txt.gz).
+                If left blank, the method will search all directories for
+                the data using the current directory as the root.
+            workers : int (optional)
+                Number of processes used to parse the yearly files in
+                parallel. If left blank the files are read one after another.
+            cache : boolean (optional)
+                If True, Hs, T and dateNum are stored as .npy files in the
+                cache directory of savePath, keyed by a hash of the contents
+                of the text files and of the processing options. Later calls
+                on unchanged files return memory-mapped arrays from the cache
+                without parsing, leaving swdList, freqList and dateList
+                empty, so getSpectralParams and harmonizeFrequencies raise a
+                ValueError. The least recently used entries are removed to
+                keep the cache below _CACHE_SIZE bytes.
         Returns
         ---------
         numYears - The number of years worth of data
@@ -1706,9 +2188,6 @@ class Buoy:
         >>> buoy = ESSC.buoy(46022)
         >>> buoy.loadFromText('./Data/NDBC460022')
         '''
-        dateVals = []
-        spectralVals = []
-        numLines = 0
         numYears = 0
 
         if dirPath is None:
@@ -1720,52 +2199,58 @@ class Buoy:
         if dirPath is None:
             raise IOError("Could not find directory containing data for NDBC%s" % self.buoyNum)
 
-        fileList = glob.glob(os.path.join(dirPath,'SWD*.txt'))
+        # A year stored both plain and compressed is read from the newest file
+        files = {}
+        for fileName in (glob.glob(os.path.join(dirPath, 'SWD*.txt')) +
+                         glob.glob(os.path.join(dirPath, 'SWD*.txt.gz'))):
+            name = re.sub(r'\.gz$', '', fileName)
+            if (name not in files or
+                    os.path.getmtime(fileName) > os.path.getmtime(files[name])):
+                files[name] = fileName
+        fileList = [files[name] for name in sorted(files)]
 
         if len(fileList) == 0:
             raise IOError("No NDBC data files found in " + dirPath)
 
-        for fileName in fileList:
+        if cache:
+            cacheDir = os.path.join(self.savePath, 'cache')
+            key = _cacheKey([(os.path.basename(fileName), _fileChecksum(fileName))
+                             for fileName in fileList], self._cacheOptions())
+            if self._loadCache(cacheDir, key):
+                return len(fileList)
+
+        if workers > 1:
+            for fileName in fileList:
+                print 'Reading from: %s' % (fileName)
+            pool = multiprocessing.Pool(min(workers, len(fileList)))
+            try:
+                # map returns the results in the order of fileList
+                results = pool.map(functools.partial(_readSWDFile,
+                                                     limits=self.qcLimits),
+                                   fileList)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = []
+            for fileName in fileList:
+                print 'Reading from: %s' % (fileName)
+                results.append(_readSWDFile(fileName, self.qcLimits))
+
+        for fileName, result in zip(fileList, results):
+            frequency, dateValues, spectralValues, counts = result
+            year = os.path.basename(fileName).split('.')[0].split('-')[-1]
+            self.qcCounts[year] = counts
             numYears += 1
-            print 'Reading from: %s' % (fileName)
-            f = open(fileName, 'r')
-            frequency = f.readline().split()
-            numCols = len(frequency)
-            if frequency[4] == 'mm':
-                frequency = np.array(frequency[5:], dtype=np.float)
-                numTimeVals = 5
-
-            else:
-                frequency = np.array(frequency[4:], dtype=np.float)
-                numTimeVals = 4
-
-            for line in f:
-                currentLine = line.split()
-                if float(currentLine[numTimeVals + 1]) < 999:
-                    numLines += 1
-                    for i in range(numTimeVals):
-                        dateVals.append(currentLine[i])
-                    for i in range(numCols - numTimeVals):
-                        spectralVals.append(currentLine[i + numTimeVals])
-
-            dateValues = np.array(dateVals, dtype=np.int)
-            spectralValues = np.array(spectralVals, dtype=np.double)
-            dateValues = np.reshape(dateValues, (numLines, numTimeVals))
-            spectralValues = np.reshape(
-                spectralValues, (numLines, (numCols - numTimeVals)))
-
-            del dateVals[:]
-            del spectralVals[:]
-
-            numLines = 0
-            numCols = 0
             self.swdList.append(spectralValues)
             self.freqList.append(frequency)
             self.dateList.append(dateValues)
         self._prepData()
+        if cache:
+            _saveCache(cacheDir, key, self)
         return numYears
 
-    def loadFromH5(self, fileName):
+    def loadFromH5(self, fileName, lazy=False, startDate=None, endDate=None):
         """
         Loads NDBCdata previously saved in a .h5 file
 
@@ -1773,6 +2258,16 @@ class Buoy:
         ----------
             fileName : string
                 Name of the .h5 file to load data from.
+            lazy : boolean (optional)
+                If True, Hs, T, dateNum and spectralParams are h5py-backed
+                arrays that read their values from the file when used,
+                instead of being read into memory. The file is not kept open.
+            startDate : datetime, date, np.datetime64 or float (optional)
+                Earliest date (or dateNum) loaded. If left blank data are
+                loaded from the start of the record.
+            endDate : datetime, date, np.datetime64 or float (optional)
+                Latest date (or dateNum) loaded. If left blank data are
+                loaded up to the end of the record.
         Example
         -------
         To load data from previously downloaded files
@@ -1780,18 +2275,65 @@ class Buoy:
         >>> import WDRT.ESSC as ESSC
         >>> buoy = ESSC.Buoy(46022)
         >>> buoy.loadFromH5("./Data")
+
+        To load the sea states of 2010 only
+
+        >>> from datetime import datetime
+        >>> buoy.loadFromH5("./Data", startDate=datetime(2010, 1, 1),
+        ...                 endDate=datetime(2010, 12, 31, 23))
         """
         _, file_extension = os.path.splitext(fileName)
         if not file_extension:
             fileName = fileName + '.h5'
         print "Reading from: ", fileName
+        import h5py
         try:
             f = h5py.File(fileName, 'r')
         except IOError:
             raise IOError("Could not find file: " + fileName)
-        self.Hs = np.array(f['buoy_Data/Hs'][:])
-        self.T = np.array(f['buoy_Data/Te'][:])
-        self.dateNum = np.array(f['buoy_Data/dateNum'][:])
+        with f:
+            gbd = f['buoy_Data']
+            datasets = [('Hs', gbd['Hs']), ('T', gbd['Te']),
+                        ('dateNum', gbd['dateNum'])]
+            if 'spectralParams' in gbd:
+                datasets.extend((name, gbd['spectralParams'][name])
+                                for name in gbd['spectralParams'])
+
+            # Rows within the requested dates; the rows of a sorted record
+            # are found by binary search, reading only a few dateNum values
+            dateNums = gbd['dateNum']
+            rows = slice(0, dateNums.shape[0])
+            if startDate is not None or endDate is not None:
+                isSorted = dateNums.attrs.get('sorted')
+                if isSorted is None:
+                    isSorted = np.all(np.diff(dateNums[:]) >= 0)
+                if isSorted:
+                    start, stop = rows.start, rows.stop
+                    if startDate is not None:
+                        start = bisect.bisect_left(dateNums, _toDateNum(startDate))
+                    if endDate is not None:
+                        stop = bisect.bisect_right(dateNums, _toDateNum(endDate))
+                    rows = slice(start, max(start, stop))
+                else:
+                    dates = dateNums[:]
+                    rows = np.ones(len(dates), dtype=bool)
+                    if startDate is not None:
+                        rows &= dates >= _toDateNum(startDate)
+                    if endDate is not None:
+                        rows &= dates <= _toDateNum(endDate)
+
+            values = {}
+            for name, dataset in datasets:
+                if not isinstance(rows, slice):
+                    values[name] = np.array(dataset[:][rows])
+                elif lazy:
+                    values[name] = _H5Array(fileName, dataset, rows.start, rows.stop)
+                else:
+                    values[name] = np.array(dataset[rows])
+        self.Hs = values.pop('Hs')
+        self.T = values.pop('T')
+        self.dateNum = values.pop('dateNum')
+        self.spectralParams = values
         print "----> SUCCESS"
 
     def saveData(self, fileName=None):
@@ -1804,25 +2346,125 @@ class Buoy:
                 Relative path for desired file.
         '''
         if (fileName is None):
-            fileName = 'NDBC' + str(self.buoy.buoyNum) + '.h5'
+            fileName = 'NDBC' + str(self.buoyNum) + '.h5'
         else:
             _, file_extension = os.path.splitext(fileName)
             if not file_extension:
                 fileName = fileName + '.h5'
-        f = h5py.File(fileName, 'w')
-        self._saveData(f)
+        import h5py
+        with h5py.File(fileName, 'w') as f:
+            self._saveData(f)
+
+    def saveSpectra(self, fileName=None):
+        '''
+        Appends the spectral data in swdList, freqList and dateList to a
+        compressed .h5 archive. Each year is stored in the group
+        spectra/<year> (a letter is appended for additional files of the same
+        year) as chunked datasets that can be extended: 'swd' (spectral wave
+        density), 'dateValues', the 'dateNum' time index and 'frequency'.
+        Years already in the archive are only extended with records later
+        than the ones stored.
+
+        Parameters
+        ----------
+            fileName : string
+                Relative path for desired file. If left blank
+                NDBC<buoyNum>-raw.h5 in savePath is used, the file also
+                written by fetchFromWeb(saveType="h5").
+
+        Returns
+        -------
+            fileName : string
+                Name of the .h5 archive.
+        '''
+        fileName = self._spectraFileName(fileName)
+        print "Saving in :", fileName
+        import h5py
+        with h5py.File(fileName, 'a') as f:
+            gsp = f.require_group('spectra')
+            for ii in range(len(self.swdList)):
+                _appendSpectra(gsp, self.freqList[ii], self.dateList[ii],
+                               np.asarray(self.swdList[ii]))
+        return fileName
+
+    def loadSpectra(self, fileName=None, lazy=True):
+        '''
+        Loads the spectral data from a .h5 archive written by saveSpectra or
+        fetchFromWeb(saveType="h5") into swdList, freqList and dateList.
+
+        Parameters
+        ----------
+            fileName : string
+                Name of the .h5 archive. If left blank NDBC<buoyNum>-raw.h5
+                in savePath is used.
+            lazy : boolean (optional)
+                If True (the default) the entries of swdList are read from
+                the file on access, so only one year of spectra is held in
+                memory at a time. The file is not kept open.
+
+        Returns
+        -------
+            numYears : int
+                The number of years worth of data
+
+        Example
+        -------
+        >>> import WDRT.ESSC as ESSC
+        >>> buoy = ESSC.Buoy(46022)
+        >>> buoy.fetchFromWeb(saveType="h5")
+        >>> buoy2 = ESSC.Buoy(46022)
+        >>> buoy2.loadSpectra()
+        '''
+        fileName = self._spectraFileName(fileName)
+        print "Reading from: ", fileName
+        if not os.path.exists(fileName):
+            raise IOError("Could not find file: " + fileName)
+        import h5py
+        with h5py.File(fileName, 'r') as f:
+            gsp = f['spectra']
+            # Years are loaded in chronological order of their first record
+            keys = sorted(gsp, key=lambda key: gsp[key]['dateNum'][0])
+            for key in keys:
+                self.freqList.append(gsp[key]['frequency'][:])
+                self.dateList.append(gsp[key]['dateValues'][:])
+                if lazy:
+                    self.swdList.append(_H5Array(fileName, gsp[key]['swd']))
+                else:
+                    self.swdList.append(gsp[key]['swd'][:])
+        self._prepData()
+        return len(keys)
+
+    def _cacheOptions(self):
+        '''Options affecting the derived data, included in the cache key.
+        '''
+        return {'qcLimits': self.qcLimits}
+
+    def _loadCache(self, cacheDir, key):
+        '''Sets Hs, T and dateNum from the cache entry with the given key.
+        Returns False if there is no such entry.
+        '''
+        values = _loadCache(cacheDir, key)
+        if values is None:
+            return False
+        print "Reading from cache:", os.path.join(cacheDir, key)
+        self.Hs = values['Hs']
+        self.T = values['T']
+        self.dateNum = values['dateNum']
+        self.qcCounts = values['qcCounts']
+        return True
+
+    def _spectraFileName(self, fileName=None):
+        if (fileName is None):
+            return os.path.join(self.savePath, 'NDBC%s-raw.h5' % (self.buoyNum))
+        _, file_extension = os.path.splitext(fileName)
+        if not file_extension:
+            fileName = fileName + '.h5'
+        return fileName
 
     def _saveData(self, fileObj):
         if(self.Hs is not None):
-            gbd = fileObj.create_group('buoy_Data')
-            f_Hs = gbd.create_dataset('Hs', data=self.Hs)
-            f_Hs.attrs['units'] = 'm'
-            f_Hs.attrs['description'] = 'significant wave height'
-            f_T = gbd.create_dataset('Te', data=self.T)
-            f_T.attrs['units'] = 'm'
-            f_T.attrs['description'] = 'energy period'
-            f_dateNum = gbd.create_dataset('dateNum', data=self.dateNum)
-            f_dateNum.attrs['description'] = 'datenum'
+            _saveBuoyData(fileObj, self.Hs, self.T, self.dateNum,
+                          self.spectralParams)
         else:
             RuntimeError('Buoy object contains no data')
 
@@ -1831,17 +2473,17 @@ class Buoy:
         NaNs.
         '''
         n = len(self.swdList)
-        Hs = []
-        T = []
-        dateNum = []
+        Hs = [np.zeros(0)]
+        T = [np.zeros(0)]
+        dateNum = [np.zeros(0)]
         for ii in range(n):
             tmp1, tmp2 = _getStats(self.swdList[ii], self.freqList[ii])
-            Hs.extend(tmp1)
-            T.extend(tmp2)
-            dateNum.extend(_getDateNums(self.dateList[ii]))
-        Hs = np.array(Hs, dtype=np.float)
-        T = np.array(T, dtype=np.float)
-        dateNum = np.array(dateNum, dtype=np.float)
+            Hs.append(tmp1)
+            T.append(tmp2)
+            dateNum.append(_getDateNums(self.dateList[ii]))
+        Hs = np.concatenate(Hs)
+        T = np.concatenate(T)
+        dateNum = np.concatenate(dateNum)
 
         # Removing NaN data, assigning T label depending on input (Te or Tp)
         Nanrem = np.logical_not(np.isnan(T) | np.isnan(Hs))
@@ -1854,8 +2496,1318 @@ class Buoy:
         self.dateNum = dateNum
         return Hs, T, dateNum
 
+    def getSpectralParams(self, params=('Tp', 'Tz', 'm2', 'm4', 'bandwidth',
+                                        'peakedness')):
+        '''Computes additional sea state parameters from the spectral data,
+        in a single pass over each year of spectra. Records removed by
+        _prepData are removed here as well, so the results line up with Hs,
+        T and dateNum.
+
+        Parameters
+        ----------
+            params : sequence of strings
+                Names of the parameters to compute, see _getSpectralParams.
+                If left blank the peak and zero crossing periods, second and
+                fourth spectral moments, spectral bandwidth and peakedness
+                are computed.
+
+        Returns
+        -------
+            spectralParams : dict
+                Arrays of the requested parameters keyed by name, also
+                stored in the spectralParams member variable.
+
+        Example
+        -------
+        To get the peak period of each sea state
+
+        >>> import WDRT.ESSC as ESSC
+        >>> buoy = ESSC.Buoy(46022)
+        >>> buoy.loadFromText()
+        >>> Tp = buoy.getSpectralParams(['Tp'])['Tp']
+        '''
+        # Sea states read from the cache of derived data or from an .h5 file
+        # have no spectra, the parameters would not line up with them
+        if len(self.swdList) == 0 and self.Hs is not None and len(self.Hs) != 0:
+            raise ValueError("No spectral data loaded for NDBC%s, load the "
+                             "text files without cache=True" % self.buoyNum)
+        params = list(params)
+        values = dict((name, [np.zeros(0)]) for name in params)
+        valid = [np.zeros(0, dtype=bool)]
+        for ii in range(len(self.swdList)):
+            yearValues = _getSpectralParams(self.swdList[ii],
+                                            self.freqList[ii],
+                                            set(params) | set(['Hs', 'Te']))
+            valid.append(np.logical_not(np.isnan(yearValues['Te']) |
+                                        np.isnan(yearValues['Hs'])))
+            for name in params:
+                values[name].append(yearValues[name])
+        valid = np.concatenate(valid)
+
+        self.spectralParams = dict((name, np.concatenate(values[name])[valid])
+                                   for name in params)
+        return self.spectralParams
+
+    def harmonizeFrequencies(self, freqGrid=None, fileName=None,
+                             memmapSize=2**28):
+        '''Interpolates the spectra of every year onto a common frequency
+        grid and stacks them into a single contiguous matrix, so spectral
+        computations can run on all sea states at once. Records removed by
+        _prepData are removed here as well, so the rows line up with Hs, T
+        and dateNum.
+
+        Parameters
+        ----------
+            freqGrid : np.array (optional)
+                Frequencies of the common grid. If left blank the
+                frequencies of the most finely resolved year are used.
+            fileName : string (optional)
+                Name of the .npy file backing swdMatrix when it is memory
+                mapped. If left blank savePath/NDBC<buoyNum>-swdMatrix.npy
+                is used.
+            memmapSize : int (optional)
+                Size in bytes above which swdMatrix is a memory-mapped .npy
+                file rather than an in-memory array.
+
+        Returns
+        -------
+            freqGrid : np.array
+                Frequencies of the common grid.
+            swdMatrix : np.array
+                Spectral wave density of each sea state (row) at each
+                frequency of the grid (column). Densities outside the
+                frequency range measured in a year are 0.
+
+        Example
+        -------
+        To compute the peak period of every sea state in one pass
+
+        >>> import WDRT.ESSC as ESSC
+        >>> buoy = ESSC.Buoy(46022)
+        >>> buoy.loadFromText()
+        >>> freqGrid, swdMatrix = buoy.harmonizeFrequencies()
+        >>> Tp = ESSC._getSpectralParams(swdMatrix, freqGrid, ['Tp'])['Tp']
+        '''
+        if len(self.swdList) == 0:
+            raise ValueError("No spectral data loaded for NDBC%s"
+                             % self.buoyNum)
+        if freqGrid is None:
+            # The last year with the most frequencies, NDBC only ever
+            # refined its frequency bins
+            numFreqs = [len(frequency) for frequency in self.freqList]
+            ii = len(numFreqs) - 1 - numFreqs[::-1].index(max(numFreqs))
+            freqGrid = self.freqList[ii]
+        freqGrid = np.array(freqGrid, dtype=float)
+
+        valid = []
+        for ii in range(len(self.swdList)):
+            Hs, T = _getStats(self.swdList[ii], self.freqList[ii])
+            valid.append(np.logical_not(np.isnan(T) | np.isnan(Hs)))
+        numRecords = sum(np.count_nonzero(mask) for mask in valid)
+
+        shape = (numRecords, len(freqGrid))
+        if numRecords * len(freqGrid) * 8 > memmapSize:
+            if fileName is None:
+                fileName = os.path.join(self.savePath,
+                                        'NDBC%s-swdMatrix.npy' % self.buoyNum)
+            swdMatrix = np.lib.format.open_memmap(fileName, mode='w+',
+                                                  dtype=float, shape=shape)
+        else:
+            swdMatrix = np.empty(shape)
+
+        row = 0
+        for ii in range(len(self.swdList)):
+            swdArr = np.asarray(self.swdList[ii])[valid[ii]]
+            _interpSpectra(swdArr, self.freqList[ii], freqGrid,
+                           swdMatrix[row:row + len(swdArr)])
+            row += len(swdArr)
+
+        self.freqGrid = freqGrid
+        self.swdMatrix = swdMatrix
+        return freqGrid, swdMatrix
+
+    def streamRealTime(self, source, pollInterval=60., maxPolls=None,
+                       proxy=None):
+        '''Generator reading an NDBC real-time spectral wave density file
+        (.data_spec) as it is updated. Each new record is appended to Hs, T
+        and dateNum before it is yielded, without recomputing the sea
+        states already loaded. Records that are not newer than the last
+        sea state loaded are skipped, so overlapping updates of the file
+        are only read once.
+
+        Parameters
+        ----------
+            source : string
+                Name of a local .data_spec file, followed as it grows or is
+                rewritten, or the URL of one (e.g.
+                "http://www.ndbc.noaa.gov/data/realtime2/46022.data_spec").
+            pollInterval : float (optional)
+                Time in seconds between checks of the source for new records.
+            maxPolls : int (optional)
+                Number of checks of the source after which the generator
+                stops. If left blank it never stops.
+            proxy : string (optional)
+                HTTP proxy used when source is a URL, e.g.
+                "http://wwwproxy.sandia.gov:80". If left blank no proxy is
+                used.
+
+        Yields
+        ------
+            dateNum : float
+                Date of the record, see dateNum.
+            frequency : np.array
+                Frequency values of the record.
+            spectralValues : np.array
+                Spectral wave density values of the record.
+
+        Note
+        ----
+        Hs, T and dateNum are views of buffers that grow as records arrive,
+        copy them to keep their values past the next record. The spectra
+        are not added to swdList.
+
+        Example
+        -------
+        To follow the sea states of buoy 46022
+
+        >>> import WDRT.ESSC as ESSC
+        >>> buoy = ESSC.Buoy('46022')
+        >>> url = 'http://www.ndbc.noaa.gov/data/realtime2/46022.data_spec'
+        >>> for dateNum, frequency, swd in buoy.streamRealTime(url, 1800.):
+        ...     print buoy.Hs[-1], buoy.T[-1]
+        '''
+        Hs = _GrowingArray(self.Hs)
+        T = _GrowingArray(self.T)
+        dateNum = _GrowingArray(self.dateNum)
+        self.Hs, self.T, self.dateNum = Hs.values, T.values, dateNum.values
+        lastDateNum = -np.inf
+        if dateNum.size != 0:
+            lastDateNum = dateNum.values[-1]
+
+        if re.match('https?://', source):
+            updates = _pollURL(source, _ndbcSession(proxy=proxy))
+        else:
+            updates = _pollFile(source)
+        polls = 0
+        while True:
+            records = _parseDataSpec(next(updates))
+            if len(records) != 0:
+                recordDates = _getDateNums(np.array([r[0] for r in records]))
+                # Sea states are kept in time order, NDBC lists the newest
+                # record first
+                order = np.argsort(recordDates, kind='mergesort')
+                recordStats = _getRecordStats(records)
+                for ii in order:
+                    if not recordDates[ii] > lastDateNum:
+                        continue
+                    lastDateNum = recordDates[ii]
+                    if np.isnan(recordStats[ii][0]) or np.isnan(recordStats[ii][1]):
+                        continue
+                    Hs.append(recordStats[ii][0])
+                    T.append(recordStats[ii][1])
+                    dateNum.append(recordDates[ii])
+                    self.Hs, self.T = Hs.values, T.values
+                    self.dateNum = dateNum.values
+                    yield recordDates[ii], records[ii][1], records[ii][2]
+            polls += 1
+            if maxPolls is not None and polls >= maxPolls:
+                return
+            time.sleep(pollInterval)
+
+class BuoyCollection:
+    '''
+    Sea states of several NDBC buoys, loaded in parallel and stacked into
+    single arrays.
+
+    Attributes
+    __________
+    buoyNums : list
+        Device numbers of the buoys in the collection.
+    Hs : array
+        Significant wave height of every station, stacked in the order of
+        buoyNums.
+    T : array
+        Energy period of every station.
+    dateNum : array
+        Date of each sea state, see Buoy.
+    stationIndex : array
+        Index into buoyNums of the station of each sea state.
+    timings : dict
+        Time in seconds taken to load each station, keyed by buoy number.
+    failures : dict
+        Error message of each station that could not be loaded, keyed by
+        buoy number. These stations have no sea states in the collection.
+    '''
+
+    def __init__(self, buoyNums, savePath='./Data/'):
+        '''
+        Parameters
+        ___________
+            buoyNums : list of strings
+                device numbers of the desired buoys
+            savePath : string
+                relative path where the data read from ndbc.noaa.gov will be
+                stored, one directory per buoy as for Buoy
+        '''
+        self.buoyNums = [str(buoyNum) for buoyNum in buoyNums]
+        self.Hs = np.zeros(0)
+        self.T = np.zeros(0)
+        self.dateNum = np.zeros(0)
+        self.stationIndex = np.zeros(0, dtype=int)
+        self.timings = {}
+        self.failures = {}
+
+        self.savePath = savePath
+
+        if not os.path.exists(savePath):
+          os.makedirs(savePath)
+
+    def load(self, source='text', paths=None, workers=1, **kwargs):
+        '''Loads the sea states of every buoy in the collection. Stations
+        that fail to load are recorded in failures and skipped, the others
+        are still loaded.
+
+        Parameters
+        ----------
+            source : string
+                "text" to use Buoy.loadFromText, "h5" to use
+                Buoy.loadFromH5 or "web" to use Buoy.fetchFromWeb.
+            paths : dict (optional)
+                Directory ("text") or file name ("h5") of each buoy, keyed
+                by buoy number. If left blank the text files are read from
+                savePath/NDBC<buoyNum> and the .h5 files from
+                NDBC<buoyNum>.h5, the locations used by fetchFromWeb and
+                Buoy.saveData.
+            workers : int (optional)
+                Number of processes loading stations in parallel. If left
+                blank the stations are loaded one after another.
+            **kwargs
+                Passed on to the Buoy method used for each station.
+
+        Returns
+        -------
+            numStations : int
+                Number of stations loaded.
+
+        Example
+        -------
+        To load three buoys previously downloaded to ./Data/
+
+        >>> import WDRT.ESSC as ESSC
+        >>> buoys = ESSC.BuoyCollection(['46022', '46050', '46089'])
+        >>> buoys.load(workers=3)
+        >>> Hs46050 = buoys.getStation('46050')[0]
+        '''
+        if source not in ('text', 'h5', 'web'):
+            raise ValueError("source must be 'text', 'h5' or 'web', not %r"
+                             % (source,))
+        if paths is None:
+            paths = {}
+        tasks = []
+        for buoyNum in self.buoyNums:
+            path = paths.get(buoyNum)
+            if path is None and source == 'text':
+                path = os.path.join(self.savePath, 'NDBC%s' % buoyNum)
+            elif path is None and source == 'h5':
+                path = 'NDBC%s.h5' % buoyNum
+            tasks.append((buoyNum, source, path, self.savePath, kwargs))
+
+        if workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(workers, len(tasks)))
+            try:
+                # map returns the results in the order of buoyNums
+                results = pool.map(_loadStation, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_loadStation(task) for task in tasks]
+
+        Hs = [np.zeros(0)]
+        T = [np.zeros(0)]
+        dateNum = [np.zeros(0)]
+        stationIndex = [np.zeros(0, dtype=int)]
+        self.timings = {}
+        self.failures = {}
+        for ii, (buoyNum, values, elapsed, error) in enumerate(results):
+            self.timings[buoyNum] = elapsed
+            if error is not None:
+                print "Failed to load NDBC%s: %s" % (buoyNum, error)
+                self.failures[buoyNum] = error
+                continue
+            print "Loaded NDBC%s in %.2f s" % (buoyNum, elapsed)
+            Hs.append(values[0])
+            T.append(values[1])
+            dateNum.append(values[2])
+            stationIndex.append(np.repeat(ii, len(values[0])))
+        self.Hs = np.concatenate(Hs)
+        self.T = np.concatenate(T)
+        self.dateNum = np.concatenate(dateNum)
+        self.stationIndex = np.concatenate(stationIndex)
+        return len(results) - len(self.failures)
+
+    def getStation(self, buoyNum):
+        '''Sea states of a single station of the collection.
+
+        Parameters
+        ----------
+            buoyNum : string
+                Device number of the buoy.
+
+        Returns
+        -------
+            Hs : array
+            T : array
+            dateNum : array
+                Sea states of the buoy, as views into the stacked arrays.
+        '''
+        ii = self.buoyNums.index(str(buoyNum))
+        start, stop = np.searchsorted(self.stationIndex, [ii, ii + 1])
+        return (self.Hs[start:stop], self.T[start:stop],
+                self.dateNum[start:stop])
+
+# Number of records per chunk of the datasets in the spectral archive
+_H5_CHUNK_ROWS = 512
+
+def _saveBuoyData(fileObj, Hs, T, dateNum=None, spectralParams=None):
+    '''Writes the sea states of a Buoy, or of a _BuoyView, to the buoy_Data
+    group of an open .h5 file, as read by Buoy.loadFromH5 and EA.load.
+
+    Parameters
+    ----------
+        fileObj : h5py.File
+            File the group is created in.
+        Hs, T : np.array
+            Significant wave height and energy period.
+        dateNum : np.array (optional)
+            Dates of the sea states, not written if left blank.
+        spectralParams : dict (optional)
+            Additional parameters computed by getSpectralParams.
+    '''
+    gbd = fileObj.create_group('buoy_Data')
+    f_Hs = gbd.create_dataset('Hs', data=Hs)
+    f_Hs.attrs['units'] = 'm'
+    f_Hs.attrs['description'] = 'significant wave height'
+    f_T = gbd.create_dataset('Te', data=T)
+    f_T.attrs['units'] = 's'
+    f_T.attrs['description'] = 'energy period'
+    if dateNum is not None:
+        f_dateNum = gbd.create_dataset('dateNum', data=dateNum)
+        f_dateNum.attrs['description'] = 'datenum'
+        f_dateNum.attrs['sorted'] = bool(np.all(np.diff(dateNum) >= 0))
+    if spectralParams:
+        gsp = gbd.create_group('spectralParams')
+        for name, values in spectralParams.items():
+            gsp.create_dataset(name, data=values)
+
+def _appendSpectra(groupObj, frequency, dateValues, spectralValues):
+    '''Appends one year of spectral data to the spectra group of a .h5
+    archive, see Buoy.saveSpectra.
+
+    Parameters
+    ----------
+        groupObj : h5py.Group
+            The spectra group of the archive.
+        frequency : np.array
+            Frequency values of the year.
+        dateValues : np.array
+            Date values (4 or 5 columns) for each record.
+        spectralValues : np.array
+            Spectral wave density values for each record.
+
+    Returns
+    -------
+        key : string
+            Name of the group the year was written to, or None if there were
+            no records.
+    '''
+    if len(spectralValues) == 0:
+        return None
+    dateNum = _getDateNums(dateValues)
+    year = str(_getDateTimes(dateValues[:1])[0].astype(object).year)
+
+    for suffix in [''] + list(string.ascii_lowercase[1:]):
+        key = year + suffix
+        if key not in groupObj:
+            break
+        gy = groupObj[key]
+        # Records are only added to the year stored with the same layout
+        if (np.array_equal(gy['frequency'][:], frequency) and
+                gy['dateValues'].shape[1] == dateValues.shape[1]):
+            numStored = gy['dateNum'].shape[0]
+            new = dateNum > gy['dateNum'][numStored - 1]
+            numNew = np.count_nonzero(new)
+            if numNew != 0:
+                for name, values in (('dateValues', dateValues),
+                                     ('dateNum', dateNum),
+                                     ('swd', spectralValues)):
+                    gy[name].resize(numStored + numNew, axis=0)
+                    gy[name][numStored:] = values[new]
+            return key
+    else:
+        raise ValueError("Too many files for year %s" % year)
+
+    gy = groupObj.create_group(key)
+    f_freq = gy.create_dataset('frequency', data=frequency)
+    f_freq.attrs['units'] = 'Hz'
+    gy.create_dataset('dateValues', data=dateValues,
+                      maxshape=(None, dateValues.shape[1]),
+                      chunks=(_H5_CHUNK_ROWS, dateValues.shape[1]),
+                      compression='gzip', shuffle=True)
+    f_dateNum = gy.create_dataset('dateNum', data=dateNum, maxshape=(None,),
+                                  chunks=(_H5_CHUNK_ROWS,),
+                                  compression='gzip', shuffle=True)
+    f_dateNum.attrs['description'] = 'datenum'
+    f_swd = gy.create_dataset('swd', data=spectralValues,
+                              maxshape=(None, spectralValues.shape[1]),
+                              chunks=(_H5_CHUNK_ROWS, spectralValues.shape[1]),
+                              compression='gzip', shuffle=True)
+    f_swd.attrs['units'] = 'm^2/Hz'
+    f_swd.attrs['description'] = 'spectral wave density'
+    return key
+
+class _H5Array(np.lib.mixins.NDArrayOperatorsMixin):
+    '''Read-only array backed by a range of rows of a dataset in a .h5 file.
+    Values are read from the file when they are used, and the file is only
+    open while data is being read. Arithmetic and the methods of np.ndarray
+    act on the values read.
+    '''
+
+    def __init__(self, fileName, dataset, start=0, stop=None):
+        '''
+        Parameters
+        ___________
+            fileName : string
+                Name of the .h5 file.
+            dataset : h5py.Dataset
+                The dataset, used for its name, shape and dtype.
+            start : int
+                First row of the dataset included.
+            stop : int
+                Row of the dataset after the last one included. If left blank
+                all rows from start are included.
+        '''
+        if stop is None:
+            stop = dataset.shape[0]
+        self.fileName = fileName
+        self.path = dataset.name
+        self.start = start
+        self.stop = stop
+        self.shape = (stop - start,) + dataset.shape[1:]
+        self.dtype = dataset.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        rows = slice(self.start, self.stop)
+        if isinstance(key, slice):
+            # Only the rows covered by a slice are read
+            first, last, step = key.indices(self.shape[0])
+            if step > 0:
+                low, high = first, max(first, last)
+            else:
+                low, high = last + 1, max(last + 1, first + 1)
+            rows = slice(self.start + low, self.start + high)
+            key = slice(None, None, step)
+        import h5py
+        with h5py.File(self.fileName, 'r') as f:
+            values = f[self.path][rows]
+        return values[key]
+
+    def __array__(self, dtype=None):
+        values = self[...]
+        if dtype is not None:
+            values = values.astype(dtype)
+        return values
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [np.asarray(x) if isinstance(x, _H5Array) else x
+                  for x in inputs]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getattr__(self, name):
+        # Forward np.ndarray methods such as mean or argsort
+        if name.startswith('__') or not hasattr(np.ndarray, name):
+            raise AttributeError(name)
+        return getattr(np.asarray(self), name)
+
+def _interpSpectra(swdArr, freqArr, freqGrid, out):
+    '''Linear interpolation of spectra onto a new frequency grid, with the
+    interpolation weights computed once for all records.
+
+    Parameters
+    ----------
+        swdArr : np.array
+            Spectral wave density of each record (row).
+        freqArr : np.array
+            Increasing frequencies of the columns of swdArr.
+        freqGrid : np.array
+            Frequencies to interpolate to.
+        out : np.array
+            Array of shape (len(swdArr), len(freqGrid)) receiving the
+            interpolated spectra, 0 outside the range of freqArr.
+    '''
+    freqArr = np.asarray(freqArr, dtype=float)
+    # Index of the frequency below each grid point, and its weight
+    lower = np.clip(np.searchsorted(freqArr, freqGrid, side='right') - 1,
+                    0, len(freqArr) - 2)
+    weight = (freqGrid - freqArr[lower]) / (freqArr[lower + 1] -
+                                            freqArr[lower])
+    inside = (freqGrid >= freqArr[0]) & (freqGrid <= freqArr[-1])
+    np.multiply(swdArr[:, lower], 1. - weight, out=out)
+    out += swdArr[:, lower + 1] * weight
+    out[:, ~inside] = 0.
+
+def _invertCDF(x, cdf, u):
+    '''Inverts tabulated CDFs, one per row, at one probability per row,
+    taking the midpoint of the grid step where each CDF reaches it.
+
+    Parameters
+    ----------
+        x : np.array
+            Increasing grid the CDFs are tabulated on.
+        cdf : np.array
+            Nondecreasing CDF values, shape (len(u), len(x)).
+        u : np.array
+            Probability to invert each CDF at.
+
+    Returns
+    -------
+        values : np.array
+            x[0] where u is below the whole CDF, x[-1] where the CDF never
+            reaches u or is undefined, and the midpoint of the grid step
+            where the CDF reaches u otherwise.
+    '''
+    u = u[:, np.newaxis]
+    with np.errstate(invalid='ignore'):
+        # Rows are sorted, so the number of values below u is the index a
+        # searchsorted of each row would return
+        index = np.sum(cdf < u, axis=1)
+        # Undefined values never reach u, rows holding them are searched
+        # for the first value that does
+        undefined = np.flatnonzero(np.isnan(cdf).any(axis=1))
+        reached = cdf[undefined] >= u[undefined]
+    index[undefined] = np.where(reached.any(axis=1), reached.argmax(axis=1),
+                                len(x))
+    values = (x[np.minimum(index, len(x) - 1)] + x[np.maximum(index - 1, 0)]) / 2
+    values[index == 0] = x[0]
+    values[index == len(x)] = x[-1]
+    return values
+
+def _parseSWD(text, limits=None):
+    '''Parses the full contents of an NDBC spectral wave density file in a
+    single pass. Records rejected by the quality control rules (see
+    _qualityControl) are removed.
+
+    Parameters
+    ----------
+        text : string
+            Contents of a SWD file, including the frequency header line.
+        limits : dict (optional)
+            Limits of Hs and Te passed to _qualityControl.
+
+    Returns
+    -------
+        frequency : np.array
+            Frequency values taken from the header line.
+        dateValues : np.array
+            Date values (4 or 5 columns) for each record.
+        spectralValues : np.array
+            Spectral wave density values for each record.
+        counts : dict
+            Number of records in the file ("records") and rejected by each
+            quality control rule.
+    '''
+    header, _, body = text.partition('\n')
+    header = header.split()
+    if len(header) < 6:
+        raise ValueError("Corrupted NDBC file: no frequency header")
+    # Files from 2005 onwards carry an additional minute column
+    if header[4] == 'mm':
+        numDates = 5
+    else:
+        numDates = 4
+    frequency = np.array(header[numDates:], dtype=np.float)
+    numCols = numDates + len(frequency)
+
+    body = body.rstrip('\n')
+    if body:
+        body += '\n'
+    numLines = body.count('\n')
+    values = _parseFixedWidth(body, numCols)
+    numMismatched = 0
+    if values is None:
+        # Files without a regular layout are tokenized record by record, and
+        # records without one value per column are dropped
+        records = [line.split() for line in body.splitlines()]
+        records = [record for record in records if len(record) == numCols]
+        numMismatched = numLines - len(records)
+        if numLines != 0 and len(records) == 0:
+            raise ValueError("Corrupted NDBC file: no record has the %d "
+                             "values of the header" % (numCols))
+        values = np.array(records, dtype=np.double).reshape((len(records),
+                                                             numCols))
+
+    dateValues = values[:, :numDates].astype(np.int)
+    spectralValues = values[:, numDates:]
+    keep, counts = _qualityControl(frequency, dateValues, spectralValues,
+                                   limits)
+    counts['records'] = numLines
+    counts['columns'] = numMismatched
+    return (frequency, dateValues[keep],
+            np.ascontiguousarray(spectralValues[keep]), counts)
+
+# Physically plausible Hs [m] and Te [s], lower limit excluded
+_QC_LIMITS = {'Hs': (0., 25.), 'Te': (0., 30.)}
+
+def _qualityControl(frequency, dateValues, spectralValues, limits=None):
+    '''Quality control of the records of a year, applied to the whole
+    record matrix at once. The rules are applied in this order, and a
+    record rejected by several rules is counted under the first one.
+    Records are rejected if:
+
+    - sentinel: a spectral value is flagged with the 999 sentinel,
+    - nonphysical: Hs or Te is undefined or outside its limits,
+    - duplicate: an earlier record has the same time stamp.
+
+    Records without the expected number of columns ("columns") are dropped
+    by _parseSWD before this stage.
+
+    Parameters
+    ----------
+        frequency : np.array
+            Frequency values of the spectra.
+        dateValues : np.array
+            Date values (4 or 5 columns) for each record.
+        spectralValues : np.array
+            Spectral wave density values for each record.
+        limits : dict (optional)
+            (lower, upper) limits of "Hs" and "Te". If left blank
+            _QC_LIMITS is used.
+
+    Returns
+    -------
+        keep : np.array
+            Boolean mask of the records passing every rule.
+        counts : dict
+            Number of records rejected by each rule.
+    '''
+    if limits is None:
+        limits = _QC_LIMITS
+    keep = np.ones(len(spectralValues), dtype=bool)
+    counts = {}
+
+    def reject(rule, rejected):
+        counts[rule] = int(np.count_nonzero(keep & rejected))
+        keep[rejected] = False
+
+    reject('sentinel', (spectralValues >= 999).any(axis=1))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Hs, Te = _getStats(spectralValues, frequency)
+        physical = np.ones(len(keep), dtype=bool)
+        for name, values in (('Hs', Hs), ('Te', Te)):
+            lower, upper = limits[name]
+            physical &= (values > lower) & (values <= upper)
+    reject('nonphysical', ~physical)
+
+    dateNum = _getDateNums(dateValues)
+    kept = np.flatnonzero(keep)
+    # np.unique returns the index of the first occurrence of each value
+    _, first = np.unique(dateNum[kept], return_index=True)
+    unique = np.zeros(len(keep), dtype=bool)
+    unique[kept[first]] = True
+    reject('duplicate', ~unique)
+    return keep, counts
+
+def _parseFixedWidth(body, numCols):
+    '''Converts the records of a SWD file to floats directly from the
+    character matrix, exploiting the fixed-width, right-justified layout NDBC
+    uses for all of its files.
+
+    Parameters
+    ----------
+        body : string
+            Records of a SWD file, each terminated by a newline.
+        numCols : int
+            Number of values per record.
+
+    Returns
+    -------
+        values : np.array
+            Array of shape (number of records, numCols), or None if the
+            records do not share a common fixed-width layout of unsigned
+            decimal numbers.
+    '''
+    lineLen = body.find('\n') + 1
+    if lineLen <= 1 or len(body) % lineLen != 0:
+        return None
+    chars = np.frombuffer(body, dtype=np.uint8).reshape((-1, lineLen))
+    if not (chars[:, -1] == ord('\n')).all():
+        return None
+    chars = chars[:, :-1]
+    space = chars == ord(' ')
+
+    # Fields are the runs of columns that hold a character in any record
+    used = ~space.all(axis=0)
+    edges = np.diff(np.concatenate(([0], used.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    if len(starts) != numCols:
+        return None
+    # Values must be right-justified without embedded spaces
+    if space[:, stops - 1].any():
+        return None
+    if (space[:, 1:] & ~space[:, :-1] & used[1:] & used[:-1]).any():
+        return None
+
+    digits = chars - np.uint8(ord('0'))
+    digits[space] = 0
+    dot = digits == np.uint8(ord('.') - ord('0'))
+    dotCols = dot.any(axis=0)
+    digits[:, dotCols] = 0
+    if (digits > 9).any():
+        return None
+
+    # Place value of every column within its field; each field may have at
+    # most one decimal point, at the same column in every record
+    place = np.zeros(chars.shape[1], dtype=np.uint32)
+    decimals = np.zeros(numCols)
+    for i in range(numCols):
+        fieldDots = np.flatnonzero(dotCols[starts[i]:stops[i]]) + starts[i]
+        if len(fieldDots) > 1 or not dot[:, fieldDots].all():
+            return None
+        cols = np.arange(starts[i], stops[i])
+        cols = cols[~dotCols[cols]]
+        place[cols] = 10 ** np.arange(len(cols) - 1, -1, -1)
+        if len(fieldDots) != 0:
+            decimals[i] = stops[i] - fieldDots[0] - 1
+
+    # Integer mantissas are exact, so a single division rounds the same way
+    # as parsing the text does
+    values = np.add.reduceat(digits * place, starts, axis=1)
+    return values / 10.0 ** decimals
+
+def _readSWDFile(fileName, limits=None):
+    '''Reads a NDBC spectral wave density text file, see _parseSWD.
+    gzip-compressed files are recognized by their header, not by their
+    name, and decompressed while they are read.
+    '''
+    with open(fileName, 'rb') as f:
+        data = f.read()
+    return _parseSWD(_decodeSWD(data), limits)
+
+def _decodeSWD(data):
+    '''Contents of a SWD file from the bytes downloaded or read from disk,
+    decompressing them if they are gzip-compressed.
+    '''
+    if data[:2] == '\x1f\x8b':
+        return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+    return data
+
+def _ndbcSession(workers=1, proxy=None):
+    '''Creates a requests session whose connection pool is large enough to be
+    shared by the given number of concurrent downloads.
+
+    Parameters
+    ----------
+        workers : int
+            Number of concurrent downloads using the session.
+        proxy : string
+            HTTP proxy used for all requests, or None.
+
+    Returns
+    -------
+        session : requests.Session
+            Session reusing connections to the NDBC website.
+    '''
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(1, workers))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if proxy is not None:
+        session.proxies = {"http": proxy, "https": proxy}
+    return session
+
+def _fetchSWD(download):
+    '''Downloads a single NDBC spectral wave density file, streaming the
+    response into the optional text file and then into _parseSWD. The text
+    file is written under a temporary name and only renamed once complete.
+
+    Parameters
+    ----------
+        download : tuple
+            (session, url, fileName, dataSetName, limits, entry) where
+            fileName is the path the raw file is written to, or None if it
+            should not be saved, limits are passed to _parseSWD and entry is
+            the manifest entry of a previous download of the file, or None.
+
+    Returns
+    -------
+        dataSetName : string
+            Name of the downloaded data set.
+        result : tuple
+            (frequency, dateValues, spectralValues, counts) as returned by
+            _parseSWD, None if the file is corrupted, or _ON_DISK if the
+            server reported the file on disk is still current.
+        entry : dict
+            Manifest entry describing the file on disk, or None.
+    '''
+    session, url, fileName, dataSetName, limits, entry = download
+    headers = {}
+    if entry is not None and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    response = session.get(url, stream=True, headers=headers)
+    response.raise_for_status()
+    if response.status_code == 304:
+        print "Not modified:", url
+        if os.path.getsize(fileName) == entry['size']:
+            return dataSetName, _ON_DISK, entry
+        # The local copy is damaged, download it again
+        response = session.get(url, stream=True)
+        response.raise_for_status()
+    print "Reading from:", response.url
+
+    if fileName is not None and fileName.endswith('.gz'):
+        # Keep the bytes as sent, even if the transfer itself was encoded
+        content = response.raw.stream(2**16, decode_content=False)
+    else:
+        content = response.iter_content(chunk_size=2**16)
+    chunks = []
+    checksum = hashlib.sha1()
+    if fileName is not None:
+        with open(fileName + '.part', 'wb') as swdFile:
+            for chunk in content:
+                swdFile.write(chunk)
+                checksum.update(chunk)
+                chunks.append(chunk)
+    else:
+        for chunk in content:
+            chunks.append(chunk)
+    data = ''.join(chunks)
+
+    try:
+        result = _parseSWD(_decodeSWD(data), limits)
+    except (ValueError, IOError, EOFError, zlib.error):
+        print "Corrupted NDBC File - Skipping"
+        if fileName is not None:
+            os.remove(fileName + '.part')
+        return dataSetName, None, None
+
+    if fileName is None:
+        return dataSetName, result, None
+    if os.name == 'nt' and os.path.exists(fileName):
+        os.remove(fileName)
+    os.rename(fileName + '.part', fileName)
+    entry = {'link': url,
+             'file': os.path.basename(fileName),
+             'size': len(data),
+             'sha1': checksum.hexdigest(),
+             'etag': response.headers.get('ETag')}
+    return dataSetName, result, entry
+
+def _readCachedSWD(fileName, entry, limits=None):
+    '''Reads a previously downloaded SWD file, checking it against its
+    manifest entry. limits are passed to _parseSWD.
+
+    Returns
+    -------
+        result : tuple
+            (frequency, dateValues, spectralValues, counts) as returned by
+            _parseSWD, or None if the file does not match its manifest entry.
+    '''
+    with open(fileName, 'rb') as f:
+        data = f.read()
+    if (len(data) != entry['size'] or
+            hashlib.sha1(data).hexdigest() != entry['sha1']):
+        return None
+    try:
+        return _parseSWD(_decodeSWD(data), limits)
+    except (ValueError, IOError, EOFError, zlib.error):
+        return None
+
+# Marks a file on disk that is current and still has to be read
+_ON_DISK = object()
+
+# Bump whenever the derived data computed from the same files change
+_CACHE_VERSION = '2'
+# Maximum total size of the cache of derived data, in bytes
+_CACHE_SIZE = 2**30
+
+def _fileChecksum(fileName):
+    '''SHA-1 checksum of the contents of a file.
+    '''
+    checksum = hashlib.sha1()
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), ''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+def _cacheKey(sources, options):
+    '''Key of an entry in the cache of derived data.
+
+    Parameters
+    ----------
+        sources : list
+            (file name, checksum) of each source file, in load order.
+        options : dict
+            Processing options affecting the derived data.
+
+    Returns
+    -------
+        key : string
+            Hash of the cache version, sources and options.
+    '''
+    checksum = hashlib.sha1(_CACHE_VERSION)
+    for name, fileChecksum in sources:
+        checksum.update('%s:%s\n' % (name, fileChecksum))
+    checksum.update(json.dumps(options, sort_keys=True))
+    return checksum.hexdigest()
+
+def _loadCache(cacheDir, key):
+    '''Reads an entry of the cache of derived data as memory-mapped arrays.
+
+    Returns
+    -------
+        values : dict
+            Hs, T and dateNum arrays and the qcCounts of the Buoy, or None if
+            there is no such entry.
+    '''
+    entryDir = os.path.join(cacheDir, key)
+    if not os.path.isdir(entryDir):
+        return None
+    # The modification time of the entry tracks its last use for eviction
+    os.utime(entryDir, None)
+    values = dict((name, np.load(os.path.join(entryDir, name + '.npy'),
+                                 mmap_mode='r'))
+                  for name in ('Hs', 'T', 'dateNum'))
+    with open(os.path.join(entryDir, 'qcCounts.json'), 'r') as f:
+        values['qcCounts'] = json.load(f)
+    return values
+
+def _saveCache(cacheDir, key, buoy, maxSize=None):
+    '''Writes the Hs, T, dateNum and qcCounts of a Buoy to the cache of
+    derived data,
+    then removes the least recently used entries until the cache is smaller
+    than maxSize bytes (_CACHE_SIZE if left blank).
+    '''
+    if maxSize is None:
+        maxSize = _CACHE_SIZE
+    entryDir = os.path.join(cacheDir, key)
+    if not os.path.isdir(entryDir):
+        # Entries are written under a temporary name so that readers never
+        # see a partial entry
+        tmpDir = '%s.tmp%d' % (entryDir, os.getpid())
+        if not os.path.exists(tmpDir):
+            os.makedirs(tmpDir)
+        for name in ('Hs', 'T', 'dateNum'):
+            np.save(os.path.join(tmpDir, name + '.npy'),
+                    np.asarray(getattr(buoy, name)))
+        with open(os.path.join(tmpDir, 'qcCounts.json'), 'w') as f:
+            json.dump(buoy.qcCounts, f)
+        try:
+            os.rename(tmpDir, entryDir)
+        except OSError:
+            # Written concurrently by another process
+            shutil.rmtree(tmpDir)
+
+    entries = []
+    for name in os.listdir(cacheDir):
+        path = os.path.join(cacheDir, name)
+        if not os.path.isdir(path) or '.tmp' in name:
+            continue
+        size = sum(os.path.getsize(os.path.join(path, fileName))
+                   for fileName in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+    totalSize = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if totalSize <= maxSize:
+            break
+        if path != entryDir:
+            shutil.rmtree(path)
+            totalSize -= size
+
+def _loadManifest(saveDir):
+    '''Reads the download manifest of a directory of SWD files, returning
+    an empty manifest if there is none.
+    '''
+    manifestName = os.path.join(saveDir, 'manifest.json')
+    if not os.path.exists(manifestName):
+        return {}
+    try:
+        with open(manifestName, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def _saveManifest(saveDir, manifest):
+    '''Writes the download manifest of a directory of SWD files. The file
+    is replaced in a single step so an interrupted write leaves the previous
+    manifest intact.
+    '''
+    manifestName = os.path.join(saveDir, 'manifest.json')
+    with open(manifestName + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    if os.name == 'nt' and os.path.exists(manifestName):
+        os.remove(manifestName)
+    os.rename(manifestName + '.tmp', manifestName)
+
+class _BuoyView(object):
+    '''Stand-in for a Buoy holding only the sea states the contour models
+    are built from, e.g. a bootstrap sample.
+
+    Parameters
+    ----------
+        Hs : np.array
+            Significant wave height.
+        T : np.array
+            Energy period.
+        buoyNum : string (optional)
+            Number of the buoy the sea states come from.
+        dateNum : np.array (optional)
+            Dates of the sea states.
+    '''
+    def __init__(self, Hs, T, buoyNum=None, dateNum=None):
+        self.Hs = Hs
+        self.T = T
+        self.buoyNum = buoyNum
+        self.dateNum = dateNum
+
+    def _saveData(self, fileObj):
+        _saveBuoyData(fileObj, self.Hs, self.T, self.dateNum)
+
+def _bootStrapSample(spec, seed):
+    '''Computes the contours of one bootstrap sample of EA.bootStrap.
+
+    Parameters
+    ----------
+        spec : tuple
+            (Hs, T, model, contourArgs). Hs and T are the original data,
+            model the (class, args, kwargs) the contour model is built with
+            and contourArgs the arguments of its getContours.
+        seed : int
+            Seed of the random stream the sample is drawn from.
+
+    Returns
+    -------
+        Hs_Return : np.array
+        T_Return : np.array
+            Contours of the sample, as returned by getContours.
+    '''
+    Hs, T, (cls, args, kwargs), contourArgs = spec
+    n = len(Hs)
+    boot_inds = np.random.RandomState(seed).randint(0, high=n, size=n)
+    essccopy = cls(_BuoyView(Hs[boot_inds], T[boot_inds]), *args, **kwargs)
+    return essccopy.getContours(*contourArgs)
+
+_bootStrapSpec = None
+
+def _initBootStrap(spec):
+    '''Stores the bootstrap specification in a worker process, so it is only
+    sent once to each worker.
+    '''
+    global _bootStrapSpec
+    _bootStrapSpec = spec
+
+def _bootStrapWorker(seed):
+    '''Computes one bootstrap sample in a worker process initialized by
+    _initBootStrap.
+    '''
+    return _bootStrapSample(_bootStrapSpec, seed)
+
+def _loadStation(task):
+    '''Loads the sea states of one station of a BuoyCollection. Defined at
+    module level so it can be sent to worker processes.
+
+    Parameters
+    ----------
+        task : tuple
+            (buoyNum, source, path, savePath, kwargs), see
+            BuoyCollection.load.
+
+    Returns
+    -------
+        buoyNum : string
+        values : tuple
+            (Hs, T, dateNum) arrays of the station, or None if it failed.
+        elapsed : float
+            Time in seconds taken to load the station.
+        error : string
+            Description of the error, or None if the station was loaded.
+    '''
+    buoyNum, source, path, savePath, kwargs = task
+    start = time.time()
+    try:
+        buoy = Buoy(buoyNum, savePath=savePath)
+        if source == 'text':
+            buoy.loadFromText(path, **kwargs)
+        elif source == 'h5':
+            buoy.loadFromH5(path, **kwargs)
+        else:
+            buoy.fetchFromWeb(savePath=savePath, **kwargs)
+        values = tuple(np.asarray(getattr(buoy, name), dtype=float)
+                       for name in ('Hs', 'T', 'dateNum'))
+    except Exception as e:
+        return buoyNum, None, time.time() - start, '%s: %s' % (
+            type(e).__name__, e)
+    return buoyNum, values, time.time() - start, None
+
+class _GrowingArray(object):
+    '''1-D float array with amortized constant time appends.
+    '''
+    def __init__(self, values=(), capacity=1024):
+        values = np.asarray(values, dtype=float)
+        self.size = len(values)
+        self._data = np.empty(max(capacity, 2 * self.size))
+        self._data[:self.size] = values
+
+    def append(self, value):
+        if self.size == len(self._data):
+            # Doubling the capacity keeps the cost of copies linear overall
+            data = np.empty(2 * len(self._data))
+            data[:self.size] = self._data[:self.size]
+            self._data = data
+        self._data[self.size] = value
+        self.size += 1
+
+    @property
+    def values(self):
+        return self._data[:self.size]
+
+def _parseDataSpec(lines):
+    '''Parses records of an NDBC real-time spectral wave density file, where
+    each spectral value is followed by its frequency in parentheses.
+    Comment lines, incomplete lines and records flagged with the 999
+    sentinel are skipped.
+
+    Parameters
+    ----------
+        lines : list of strings
+            Lines of a .data_spec file.
+
+    Returns
+    -------
+        records : list
+            (dateValues, frequency, spectralValues) of each record, with the
+            5 date columns as in _parseSWD.
+    '''
+    records = []
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        # Columns: YY MM DD hh mm Sep_Freq, then "spec_i (freq_i)" pairs
+        tokens = line.replace('(', ' ').replace(')', ' ').split()
+        if len(tokens) < 8 or len(tokens) % 2 != 0:
+            continue
+        try:
+            dateValues = np.array(tokens[:5], dtype=int)
+            spectralValues = np.array(tokens[6::2], dtype=np.float)
+            frequency = np.array(tokens[7::2], dtype=np.float)
+        except ValueError:
+            continue
+        if np.any(spectralValues >= 999):
+            continue
+        records.append((dateValues, frequency, spectralValues))
+    return records
+
+def _getRecordStats(records):
+    '''Hs and Te of each record returned by _parseDataSpec, computed in one
+    pass over each set of records sharing their frequencies.
+
+    Returns
+    -------
+        stats : np.array
+            Hs and Te of each record, in columns.
+    '''
+    stats = np.empty((len(records), 2))
+    groups = {}
+    for ii, (_, frequency, _) in enumerate(records):
+        groups.setdefault(frequency.tostring(), []).append(ii)
+    for indices in groups.values():
+        frequency = records[indices[0]][1]
+        swdArr = np.array([records[ii][2] for ii in indices])
+        stats[indices, 0], stats[indices, 1] = _getStats(swdArr, frequency)
+    return stats
+
+def _pollFile(fileName):
+    '''Generator returning the complete lines added to a file since the
+    previous call. If the file is truncated or rewritten it is read again
+    from the start.
+    '''
+    offset = 0
+    head = ''
+    partial = ''
+    while True:
+        lines = []
+        if os.path.exists(fileName):
+            with open(fileName, 'r') as f:
+                # A file rewritten in place no longer starts with the bytes
+                # read so far
+                if (os.path.getsize(fileName) < offset or
+                        f.read(len(head)) != head):
+                    offset = 0
+                    partial = ''
+                f.seek(offset)
+                text = f.read()
+                offset = f.tell()
+                f.seek(0)
+                head = f.read(min(offset, 4096))
+            lines = (partial + text).split('\n')
+            # The last line may still be being written
+            partial = lines.pop()
+        yield lines
+
+def _pollURL(url, session):
+    '''Generator returning the lines of a file served over HTTP each time
+    it changes, and no lines while it is unchanged.
+    '''
+    etag = None
+    while True:
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        response = session.get(url, headers=headers)
+        if response.status_code == 304:
+            yield []
+            continue
+        response.raise_for_status()
+        etag = response.headers.get('ETag')
+        yield response.text.splitlines()
+
+def _getDateTimes(dateArr):
+    '''Converts NDBC date values to datetime64 values.
+
+    Parameters
+    ----------
+        dateArr : np.array
+            Array of a specific years date vals from NDBC.fetchFromWeb, with
+            4 (year, month, day, hour) or 5 (..., minute) columns. Two digit
+            years are taken to be in the 20th century. The array is not
+            modified.
+
+    Returns
+    -------
+        dateTimes : np.array
+            Array of datetime64 values with a resolution of one minute.
+    '''
+    dateArr = np.asarray(dateArr, dtype=np.int64)
+    years = dateArr[:, 0]
+    years = np.where(years < 1900, years + 1900, years)
+    # Build the dates by offsetting from the start of each year and month
+    dateTimes = (years - 1970).astype('datetime64[Y]').astype('datetime64[M]')
+    dateTimes = dateTimes + (dateArr[:, 1] - 1).astype('timedelta64[M]')
+    dateTimes = dateTimes.astype('datetime64[D]')
+    dateTimes = dateTimes + (dateArr[:, 2] - 1).astype('timedelta64[D]')
+    dateTimes = dateTimes.astype('datetime64[m]')
+    dateTimes = dateTimes + dateArr[:, 3].astype('timedelta64[h]')
+    if dateArr.shape[1] > 4:
+        dateTimes = dateTimes + dateArr[:, 4].astype('timedelta64[m]')
+    return dateTimes
+
 def _getDateNums(dateArr):
-    '''datetime objects
+    '''Date numbers
 
     Parameters
     ----------
@@ -1865,20 +3817,36 @@ def _getDateNums(dateArr):
     Returns
     -------
         dateNum : np.array
-            Array of datetime objects.
+            Proleptic Gregorian ordinal of each date (as returned by
+            date.toordinal), with the time of day as the fractional part.
     '''
-    dateNum = []
-    for times in dateArr:
-        if  times[0] < 1900:
-            times[0] = 1900 + times[0]
-        if times[0] < 2005:
-            dateNum.append(date.toordinal(datetime(times[0], times[1],
-                                                   times[2], times[3])))
-        else:
-            dateNum.append(date.toordinal(datetime(times[0], times[1],
-                                                   times[2], times[3],
-                                                   times[4])))
-    return dateNum
+    dateTimes = _getDateTimes(dateArr)
+    return ((dateTimes - np.datetime64('0001-01-01T00:00')) /
+            np.timedelta64(1, 'D') + 1.)
+
+def _toDateNum(value):
+    '''Converts a date to the dateNum convention of Buoy, see _getDateNums.
+
+    Parameters
+    ----------
+        value : datetime, date, np.datetime64 or float
+            The date. Floats are taken to be dateNum values already.
+
+    Returns
+    -------
+        dateNum : float
+            Proleptic Gregorian ordinal of the date, with the time of day as
+            the fractional part.
+    '''
+    if isinstance(value, datetime):
+        return (value.toordinal() + (value.hour * 3600. + value.minute * 60. +
+                                     value.second) / 86400.)
+    if isinstance(value, date):
+        return float(value.toordinal())
+    if isinstance(value, np.datetime64):
+        return ((value - np.datetime64('0001-01-01T00:00')) /
+                np.timedelta64(1, 'D') + 1.)
+    return float(value)
 
 def _getStats(swdArr, freqArr):
         '''Significant wave height and energy period
@@ -1892,23 +3860,101 @@ def _getStats(swdArr, freqArr):
 
         Returns
         -------
-            Hm0 : list
+            Hm0 : np.array
                 Significant wave height.
-            Te : list
+            Te : np.array
                 Energy period.
         '''
-        #Ignore divide by 0 warnings and resulting NaN warnings
+        values = _getSpectralParams(swdArr, freqArr, ('Hs', 'Te'))
+        return values['Hs'], values['Te']
+
+# Spectral moment orders required by each derived sea state parameter
+_DERIVED_PARAMS = {'Hs': (0,),
+                   'Te': (-1, 0),
+                   'Tm01': (0, 1),
+                   'Tz': (0, 2),
+                   'Tp': (),
+                   'bandwidth': (0, 2, 4),
+                   'peakedness': (0,)}
+
+def _getSpectralParams(swdArr, freqArr, params):
+    '''Spectral moments and derived sea state parameters for every record
+    of a spectral matrix. All requested moments are integrated (trapezoidal
+    rule) in a single matrix product.
 
-        np.seterr(all='ignore')
+    Parameters
+    ----------
+        swdArr : np.array
+            Numpy array of the spectral wave density data for a specific year
+        freqArr: np.array
+            Numpy array that contains the frequency values for a specific year
+        params : sequence of strings
+            Names of the parameters to compute:
+            'm<n>' : spectral moment of integer order n, e.g. 'm-1' or 'm4'
+            'Hs' : significant wave height, 4.004 * m0 ** 0.5
+            'Te' : energy period, m-1 / m0
+            'Tm01' : mean period, m0 / m1
+            'Tz' : zero crossing period, (m0 / m2) ** 0.5
+            'Tp' : peak period, inverse of the frequency of the spectral peak
+            'bandwidth' : spectral bandwidth, (1 - m2 ** 2 / (m0 * m4)) ** 0.5
+            'peakedness' : Goda's peakedness parameter,
+            2 / m0 ** 2 * integral(f * S(f) ** 2)
 
-        Hm0 = []
-        T = []
+    Returns
+    -------
+        values : dict
+            Arrays of the requested parameters keyed by name.
+    '''
+    swdArr = np.asarray(swdArr)
+    orders = set()
+    for name in params:
+        if name in _DERIVED_PARAMS:
+            orders.update(_DERIVED_PARAMS[name])
+        else:
+            orders.add(_momentOrder(name))
+    orders = sorted(orders)
+
+    # Trapezoidal rule weights of each frequency bin
+    halfWidths = np.diff(freqArr) / 2.
+    weights = np.zeros(len(freqArr))
+    weights[:-1] += halfWidths
+    weights[1:] += halfWidths
+
+    #Ignore divide by 0 warnings and resulting NaN warnings
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kernel = (weights[:, np.newaxis] *
+                  freqArr[:, np.newaxis] ** np.array(orders, dtype=np.float))
+        moments = dict(zip(orders, np.dot(swdArr, kernel).T))
+
+        values = {}
+        for name in params:
+            if name == 'Hs':
+                values[name] = 4.004 * moments[0] ** 0.5
+            elif name == 'Te':
+                values[name] = moments[-1] / moments[0]
+            elif name == 'Tm01':
+                values[name] = moments[0] / moments[1]
+            elif name == 'Tz':
+                values[name] = (moments[0] / moments[2]) ** 0.5
+            elif name == 'Tp':
+                peak = np.argmax(swdArr, axis=1)
+                values[name] = np.where(np.amax(swdArr, axis=1) > 0,
+                                        1. / freqArr[peak], np.nan)
+            elif name == 'bandwidth':
+                values[name] = (1. - moments[2] ** 2 /
+                                (moments[0] * moments[4])) ** 0.5
+            elif name == 'peakedness':
+                values[name] = (2. / moments[0] ** 2 *
+                                np.dot(swdArr ** 2, weights * freqArr))
+            else:
+                values[name] = moments[_momentOrder(name)]
 
-        for line in swdArr:
-            m_1 = np.trapz(line * freqArr ** (-1), freqArr)
-            m0 = np.trapz(line, freqArr)
-            Hm0.append(4.004 * m0 ** 0.5)
-            T.append(m_1 / m0)
-        np.seterr(all='warn')
+    return values
 
-        return Hm0, T
+def _momentOrder(name):
+    '''Order of the spectral moment named 'm<n>', e.g. -1 for 'm-1'.
+    '''
+    match = re.match(r'^m(-?[0-9]+)$', name)
+    if match is None:
+        raise ValueError("Unknown spectral parameter: %s" % name)
+    return int(match.group(1))
@@ -14,7 +14,6 @@
 # limitations under the License.
 
 import numpy as np
-from pylab import find
 
 
 def EqLoad(F, N, m):
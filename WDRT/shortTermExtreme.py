@@ -24,7 +24,6 @@ import numpy as np
 import scipy.interpolate as interp
 import scipy.stats as stats
 import scipy.optimize as optim
-import matplotlib.pyplot as plt
 
 
 class ecmDist():
@@ -632,6 +631,7 @@ def goodnessOfFitPlots(data, prob_func, x_pdf, bins_pdf=20, np_return=100001, m_
         prob_func.cdf.bounds_error=False
         prob_func.ppf.bounds_error=False
     # figure
+    import matplotlib.pyplot as plt
     fgof = plt.figure()
     ax1 = fgof.add_subplot(2,2,1)
     plt.title('Probability Plot')
@@ -779,6 +779,7 @@ def compare_methods(x, t, t_st, methods=[1,2,3,4,5],colors=['g','b','r','k','k']
         m5['ev'] = m5['stextreme_dist'].mean()
         expected_value_of_short_term_extreme['block_maxima_gumbel'] = m5['ev']
     # plot peaks distribution
+    import matplotlib.pyplot as plt
     fig1 = plt.figure()
     ax = plt.subplot(2, 1, 1)
     plt.hold(True)
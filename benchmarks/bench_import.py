@@ -0,0 +1,84 @@
+# Copyright 2016 Sandia Corporation and the National Renewable Energy
+# Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Benchmark of the import time of the WDRT modules.
+
+Each module is imported in a fresh interpreter, several times, and the best
+time is compared against its budget. The plotting, machine learning, HDF5
+and network packages are only imported by the functions using them, so
+importing a module must not load any of them. Exits with status 1 if a
+module is over budget or loads one of these packages.
+
+Usage::
+
+    python bench_import.py [repeats]
+'''
+
+import os
+import subprocess
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Import time budget of each module, in seconds
+budgets = [('WDRT.ESSC', 0.5),
+           ('WDRT.shortTermExtreme', 0.5),
+           ('WDRT.longTermExtreme', 0.3),
+           ('WDRT.fatigue', 0.2),
+           ('mler', 0.3)]
+
+# Packages that must only be imported when used
+deferred = ['matplotlib', 'pylab', 'sklearn', 'h5py', 'requests', 'bs4',
+            'urllib2']
+
+child = '''
+import sys, time
+sys.path[:0] = [%r, %r]
+start = time.time()
+import %s
+elapsed = time.time() - start
+print elapsed
+print ' '.join(name for name in %r if name in sys.modules)
+'''
+
+
+def timeImport(module):
+    script = child % (root, os.path.join(root, 'WDRT', 'MLER_toolbox'),
+                      module, deferred)
+    output = subprocess.check_output([sys.executable, '-c', script])
+    elapsed, loaded = (output.split('\n') + [''])[:2]
+    return float(elapsed), loaded.split()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        repeats = int(sys.argv[1])
+    else:
+        repeats = 5
+
+    failed = False
+    for module, budget in budgets:
+        results = [timeImport(module) for _ in range(repeats)]
+        elapsed = min(result[0] for result in results)
+        loaded = results[0][1]
+        status = 'ok'
+        if elapsed > budget:
+            status = 'OVER BUDGET'
+        if loaded:
+            status = 'loads ' + ', '.join(loaded)
+        failed = failed or status != 'ok'
+        print '%-24s %.3f s (budget %.1f s) %s' % (module, elapsed, budget,
+                                                   status)
+    sys.exit(1 if failed else 0)
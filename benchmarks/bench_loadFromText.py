@@ -0,0 +1,107 @@
+# Copyright 2016 Sandia Corporation and the National Renewable Energy
+# Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Benchmark of the NDBC spectral wave density text parser.
+
+Compares the line-by-line tokenizer previously used by Buoy.loadFromText
+against the bulk parser (ESSC._readSWDFile) on the multi-decade record of
+station 46022 shipped with the examples, and checks both give identical
+arrays.
+
+Usage::
+
+    python bench_loadFromText.py [dirPath]
+'''
+
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import WDRT.ESSC as ESSC
+
+
+def legacyReadSWDFile(fileName):
+    '''Line-by-line parser as formerly implemented in Buoy.loadFromText'''
+    dateVals = []
+    spectralVals = []
+    numLines = 0
+    f = open(fileName, 'r')
+    frequency = f.readline().split()
+    numCols = len(frequency)
+    if frequency[4] == 'mm':
+        frequency = np.array(frequency[5:], dtype=np.float)
+        numTimeVals = 5
+    else:
+        frequency = np.array(frequency[4:], dtype=np.float)
+        numTimeVals = 4
+
+    for line in f:
+        currentLine = line.split()
+        if float(currentLine[numTimeVals + 1]) < 999:
+            numLines += 1
+            for i in range(numTimeVals):
+                dateVals.append(currentLine[i])
+            for i in range(numCols - numTimeVals):
+                spectralVals.append(currentLine[i + numTimeVals])
+    f.close()
+
+    dateValues = np.array(dateVals, dtype=np.int)
+    spectralValues = np.array(spectralVals, dtype=np.double)
+    dateValues = np.reshape(dateValues, (numLines, numTimeVals))
+    spectralValues = np.reshape(
+        spectralValues, (numLines, (numCols - numTimeVals)))
+    return frequency, dateValues, spectralValues
+
+
+def legacyReadSWDFileQC(fileName):
+    '''Line-by-line parser followed by the quality control stage now applied
+    by the bulk parser'''
+    frequency, dateValues, spectralValues = legacyReadSWDFile(fileName)
+    keep, _ = ESSC._qualityControl(frequency, dateValues, spectralValues)
+    return frequency, dateValues[keep], spectralValues[keep]
+
+
+def timeParser(parser, fileList):
+    start = time.time()
+    results = [parser(fileName) for fileName in fileList]
+    return time.time() - start, results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        dirPath = sys.argv[1]
+    else:
+        dirPath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '..', 'examples', 'data', 'NDBC46022')
+    fileList = sorted(glob.glob(os.path.join(dirPath, 'SWD*.txt')))
+    if len(fileList) == 0:
+        raise IOError("No NDBC data files found in " + dirPath)
+
+    legacyTime, legacyResults = timeParser(legacyReadSWDFileQC, fileList)
+    bulkTime, bulkResults = timeParser(ESSC._readSWDFile, fileList)
+
+    for legacy, bulk in zip(legacyResults, bulkResults):
+        for legacyArr, bulkArr in zip(legacy, bulk):
+            np.testing.assert_array_equal(legacyArr, bulkArr)
+
+    numRecords = sum(len(result[1]) for result in bulkResults)
+    print 'Files: %d, records: %d' % (len(fileList), numRecords)
+    print 'Line-by-line parser: %.3f s' % (legacyTime)
+    print 'Bulk parser:         %.3f s' % (bulkTime)
+    print 'Speedup:             %.1fx' % (legacyTime / bulkTime)